@@ -2,11 +2,14 @@ import Cookie
 import hashlib
 import json
 import logging
+import threading
 import urllib
 
-from google.appengine.api import urlfetch
+from google.appengine.api import memcache
 import webapp2
 
+import httpclient
+
 
 class TestAuthService(object):
 
@@ -84,29 +87,85 @@ class ProdAuthService(object):
 
   requires_https = True
 
-  def __init__(self, service_url):
+  # seconds the auth service's answer for an auth cookie is reused. answers
+  # for logged out users also depend on return_to, so they are cached per
+  # page and for less time.
+  LOGGED_IN_TTL = 60
+  LOGGED_OUT_TTL = 15
+
+  def __init__(self, service_url, client=None):
     self.url = service_url
+    self.client = client or httpclient.SHARED
+    self._lock = threading.Lock()
+    self.stats = {"hits": 0, "negative_hits": 0, "misses": 0,
+                  "invalidations": 0}
 
-  def getAuthResponse(self, auth_token, return_to):
+  def _count(self, stat):
+    with self._lock:
+      self.stats[stat] += 1
+
+  @staticmethod
+  def _hash(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+  def _cacheKeys(self, auth_token, return_to):
+    token_hash = self._hash(auth_token)
+    return ("auth:%s" % token_hash,
+            "auth_anon:%s:%s" % (token_hash, self._hash(return_to)))
+
+  def _fetchAuthResponse(self, auth_token, return_to):
     c = Cookie.SimpleCookie()
     c["auth"] = auth_token
+    resp = self.client.fetch(
+        "auth.current_user",
+        "%s/v1/current_user?%s" % (self.url, urllib.urlencode({
+            "return_to": return_to})),
+        headers={"Cookie": c["auth"].OutputString()})
+    if resp.status_code != 200:
+      raise Exception("Unexpected authentication error: %s", resp.content)
+    return json.loads(resp.content)
+
+  def getAuthResponse(self, auth_token, return_to):
+    user_key, anon_key = self._cacheKeys(auth_token, return_to)
+    cached = memcache.get_multi([user_key, anon_key])
+    if user_key in cached:
+      self._count("hits")
+      return cached[user_key]
+    if anon_key in cached:
+      self._count("negative_hits")
+      return cached[anon_key]
+    self._count("misses")
     try:
-      resp = urlfetch.fetch(
-          "%s/v1/current_user?%s" % (self.url, urllib.urlencode({
-              "return_to": return_to})),
-          headers={"Cookie": c["auth"].OutputString()},
-          follow_redirects=False,
-          validate_certificate=True)
-      if resp.status_code != 200:
-        raise Exception("Unexpected authentication error: %s", resp.content)
-      return json.loads(resp.content)
+      response = self._fetchAuthResponse(auth_token, return_to)
     except Exception:
       logging.exception("failed getting current user, assuming logged out")
       return {"logged_in": False, "login_links": {}}
+    if response.get("logged_in"):
+      memcache.set(user_key, response, self.LOGGED_IN_TTL)
+    else:
+      memcache.set(anon_key, response, self.LOGGED_OUT_TTL)
+    return response
+
+  def invalidate(self, auth_token):
+    """Forgets the cached logged in answer for an auth cookie."""
+    self._count("invalidations")
+    memcache.delete(self._cacheKeys(auth_token, "")[0])
 
   def getLogoutLink(self, return_to):
+    # goes through ProdLogoutHandler so the cached answer can be dropped
+    return "/_auth/logout?%s" % urllib.urlencode({"return_to": return_to})
+
+  def getServiceLogoutLink(self, return_to):
     return "%s/v1/logout?%s" % (self.url, urllib.urlencode({
         "return_to": return_to}))
 
   def handlers(self):
-    return []
+    return [webapp2.Route(r'/_auth/logout', ProdLogoutHandler,
+                          defaults={"service": self})]
+
+
+class ProdLogoutHandler(webapp2.RequestHandler):
+  def get(self, service):
+    service.invalidate(self.request.cookies.get("auth", ""))
+    return self.redirect(str(service.getServiceLogoutLink(
+        self.request.get("return_to"))))
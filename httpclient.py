@@ -0,0 +1,325 @@
+"""The outbound HTTP layer shared by ProdPledgeService and ProdAuthService.
+
+HttpClient puts explicit deadlines on every call, bounds how many calls are
+in flight at once and keeps a latency histogram per endpoint. The transport
+does the actual fetching: UrlfetchTransport in production, FakeTransport in
+tests.
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+from google.appengine.api import urlfetch
+
+
+class HttpClientBusy(Exception):
+  """Raised when a call waited queue_timeout seconds for a free slot."""
+
+
+class UrlfetchTransport(object):
+  """Fetches with async urlfetch RPCs. urlfetch keeps its own connections
+  to each host alive between calls, so there is no pool to manage here.
+  """
+
+  def start(self, url, method, payload, headers, deadline,
+            validate_certificate):
+    rpc = urlfetch.create_rpc(deadline=deadline)
+    urlfetch.make_fetch_call(rpc, url, payload=payload, method=method,
+                             headers=headers, follow_redirects=False,
+                             validate_certificate=validate_certificate)
+    return rpc
+
+
+class FakeResponse(object):
+  def __init__(self, status_code, content="", headers=None):
+    self.status_code = status_code
+    self.content = content
+    self.headers = headers or {}
+
+
+class _FakeRPC(object):
+  def __init__(self, result):
+    self._result = result
+
+  def get_result(self):
+    if isinstance(self._result, BaseException):
+      raise self._result
+    return self._result
+
+
+class FakeTransport(object):
+  """A transport for tests. Answers with the first route whose url prefix
+  matches, and records every request in self.requests.
+
+  A route's answer is a FakeResponse, an exception to raise, or a function
+  called with (url, method, payload, headers) that returns one of those.
+  Unrouted urls get a 404.
+  """
+
+  def __init__(self, routes=None):
+    self.routes = list(routes or [])
+    self.requests = []
+
+  def route(self, url_prefix, answer):
+    self.routes.append((url_prefix, answer))
+
+  def start(self, url, method, payload, headers, deadline,
+            validate_certificate):
+    self.requests.append((method, url, payload, headers))
+    for url_prefix, answer in self.routes:
+      if url.startswith(url_prefix):
+        if callable(answer):
+          answer = answer(url, method, payload, headers)
+        return _FakeRPC(answer)
+    return _FakeRPC(FakeResponse(404, "no fake route for %s" % url))
+
+
+class LatencyHistogram(object):
+  """Counts call latencies into BUCKETS_MS, keyed by upper bound."""
+
+  BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+  def __init__(self):
+    self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+    self.errors = 0
+
+  def add(self, ms, error=False):
+    self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+    if error:
+      self.errors += 1
+
+  def export(self):
+    buckets = dict(("<=%d" % bound, count) for bound, count in
+                   zip(self.BUCKETS_MS, self.counts))
+    buckets[">%d" % self.BUCKETS_MS[-1]] = self.counts[-1]
+    return {"buckets": buckets, "count": sum(self.counts),
+            "errors": self.errors}
+
+
+class _Call(object):
+  """An in flight HttpClient call. get_result waits for the response and
+  frees the call's slot.
+  """
+
+  def __init__(self, client, endpoint, rpc):
+    self._client = client
+    self._endpoint = endpoint
+    self._rpc = rpc
+    self._start = time.time()
+    self._done = False
+
+  def get_result(self):
+    error = True
+    try:
+      result = self._rpc.get_result()
+      error = result.status_code >= 500
+      return result
+    finally:
+      self._finish(error)
+
+  def _finish(self, error):
+    if not self._done:
+      self._done = True
+      self._client._finished(self._endpoint,
+                             (time.time() - self._start) * 1000, error)
+
+  def abandon(self):
+    """Frees the call's slot without waiting for the response, for a caller
+    that gives up on it. Does nothing once get_result returned.
+    """
+    self._finish(True)
+
+
+class HttpClient(object):
+  """Makes HTTP calls through transport with a deadline, at most
+  max_in_flight at a time. A call that finds every slot taken waits up to
+  queue_timeout seconds, then raises HttpClientBusy.
+  """
+
+  def __init__(self, transport=None, deadline=10, max_in_flight=20,
+               queue_timeout=5):
+    self.transport = transport or UrlfetchTransport()
+    self.deadline = deadline
+    self.max_in_flight = max_in_flight
+    self.queue_timeout = queue_timeout
+    self._in_flight = 0
+    self._slots = threading.Condition(threading.Lock())
+    self._histograms = {}
+
+  def _acquire(self):
+    give_up = time.time() + self.queue_timeout
+    with self._slots:
+      while self._in_flight >= self.max_in_flight:
+        remaining = give_up - time.time()
+        if remaining <= 0:
+          raise HttpClientBusy("%d calls already in flight" %
+                               self._in_flight)
+        self._slots.wait(remaining)
+      self._in_flight += 1
+
+  def _finished(self, endpoint, ms, error):
+    with self._slots:
+      self._in_flight -= 1
+      self._slots.notify()
+      if endpoint not in self._histograms:
+        self._histograms[endpoint] = LatencyHistogram()
+      self._histograms[endpoint].add(ms, error)
+
+  def start(self, endpoint, url, method=urlfetch.GET, payload=None,
+            headers=None, deadline=None, validate_certificate=True):
+    """Starts a call and returns it; its get_result() returns the response.
+    endpoint names the kind of call for the latency histograms.
+    """
+    self._acquire()
+    try:
+      rpc = self.transport.start(url, method, payload, headers or {},
+                                 deadline or self.deadline,
+                                 validate_certificate)
+    except Exception:
+      # the call never started, give its slot back
+      self._finished(endpoint, 0, True)
+      raise
+    return _Call(self, endpoint, rpc)
+
+  def fetch(self, endpoint, url, **kwargs):
+    return self.start(endpoint, url, **kwargs).get_result()
+
+  @property
+  def stats(self):
+    with self._slots:
+      return {"in_flight": self._in_flight,
+              "endpoints": dict((endpoint, histogram.export())
+                                for endpoint, histogram in
+                                self._histograms.iteritems())}
+
+
+class CircuitOpen(Exception):
+  """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker(object):
+  """Stops calling a failing or slow dependency for a while.
+
+  The breaker looks at the last `window` calls. Once there are at least
+  min_calls, it opens when the share of failed calls reaches error_rate or
+  the share slower than slow_ms reaches slow_rate. While open every call
+  raises CircuitOpen. After open_seconds it is half open: one call at a
+  time goes through as a probe, and the first probe to succeed closes the
+  breaker again while a failed one reopens it.
+
+  Exceptions in `ignore` don't count as calls at all: by default
+  HttpClientBusy, which says this instance is out of client slots, not that
+  the dependency is unwell.
+  """
+
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+  def __init__(self, name, window=20, min_calls=10, error_rate=0.5,
+               slow_ms=5000, slow_rate=0.5, open_seconds=30,
+               ignore=(HttpClientBusy,)):
+    self.name = name
+    self.window = window
+    self.min_calls = min_calls
+    self.error_rate = error_rate
+    self.slow_ms = slow_ms
+    self.slow_rate = slow_rate
+    self.open_seconds = open_seconds
+    self.ignore = ignore
+    self._lock = threading.Lock()
+    self._calls = collections.deque(maxlen=window)
+    self._state = self.CLOSED
+    self._opened_at = None
+    self._probing = False
+    self._counts = {"rejected": 0, "trips": 0, "ignored": 0}
+
+  def _trip(self):
+    self._state = self.OPEN
+    self._opened_at = time.time()
+    self._probing = False
+    self._calls.clear()
+    self._counts["trips"] += 1
+
+  def _allow(self):
+    with self._lock:
+      if (self._state == self.OPEN and
+          time.time() - self._opened_at >= self.open_seconds):
+        self._state = self.HALF_OPEN
+      if self._state == self.CLOSED:
+        return False
+      if self._state == self.HALF_OPEN and not self._probing:
+        self._probing = True
+        return True
+      self._counts["rejected"] += 1
+    raise CircuitOpen("%s is unavailable" % self.name)
+
+  def _record(self, probe, ok, ms):
+    with self._lock:
+      if probe:
+        self._probing = False
+        if ok and ms < self.slow_ms:
+          self._state = self.CLOSED
+        else:
+          self._trip()
+        return
+      if self._state != self.CLOSED:
+        return
+      self._calls.append((ok, ms >= self.slow_ms))
+      if len(self._calls) < self.min_calls:
+        return
+      failed = sum(1 for call_ok, _ in self._calls if not call_ok)
+      slow = sum(1 for _, is_slow in self._calls if is_slow)
+      if (failed >= self.error_rate * len(self._calls) or
+          slow >= self.slow_rate * len(self._calls)):
+        self._trip()
+
+  def _skip(self, probe):
+    with self._lock:
+      if probe:
+        self._probing = False
+      self._counts["ignored"] += 1
+
+  def call(self, fn, *args, **kwargs):
+    """Returns fn(*args, **kwargs), or raises CircuitOpen without calling
+    it. A call fails when fn raises (other than an `ignore` exception) or
+    returns a response with a 5xx status_code.
+    """
+    probe = self._allow()
+    start = time.time()
+    ok, ignored = False, False
+    try:
+      result = fn(*args, **kwargs)
+      ok = getattr(result, "status_code", 200) < 500
+      return result
+    except self.ignore:
+      ignored = True
+      raise
+    finally:
+      # also on BaseExceptions such as DeadlineExceededError, so a probe
+      # is never left in flight
+      if ignored:
+        self._skip(probe)
+      else:
+        self._record(probe, ok, (time.time() - start) * 1000)
+
+  @property
+  def state(self):
+    with self._lock:
+      if (self._state == self.OPEN and
+          time.time() - self._opened_at >= self.open_seconds):
+        return self.HALF_OPEN
+      return self._state
+
+  @property
+  def stats(self):
+    state = self.state
+    with self._lock:
+      return dict(self._counts, state=state, recent_calls=len(self._calls))
+
+
+# the client ProdPledgeService and ProdAuthService use unless given one, so
+# max_in_flight bounds their calls together
+SHARED = HttpClient()
@@ -1,54 +1,102 @@
+import collections
 import csv
 import functools
 import hashlib
+import hmac
+import base64
+import bisect
+import datetime
 import json
-import os
+import random
 import re
 import urllib
-import urlparse
 import logging
-import traceback
+import threading
+import time
+import zlib
 
 import jinja2
-import markdown
 import webapp2
-import wtforms
-
-from wtforms.fields.html5 import IntegerField
-from wtforms.widgets.html5 import URLInput
 
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
-from google.appengine.api import urlfetch
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
 import config_NOCOMMIT
+import httpclient
+import pledge
+import templating
 
-JINJA = jinja2.Environment(
-  loader=jinja2.FileSystemLoader('templates/'),
-  extensions=['jinja2.ext.autoescape'],
-  autoescape=True)
-JINJA.filters["urlencode"] = \
-    lambda s: urllib.quote(s.encode('ascii', errors='ignore'), safe="")
+JINJA = templating.environment(memcache)
 
-YOUTUBE_ID_VALIDATOR = re.compile(r'^[\w\-]+$')
 INVALID_SLUG_CHARS = re.compile(r'[^\w-]')
 MULTIDASH_RE = re.compile(r'-+')
-SLUG_TOKEN_AMOUNT = 2
-
-DEFAULT_TITLE = ""
-
-DEFAULT_DESC = u"""\
-I recently joined Lessig's citizen-funded MAYDAY.US campaign, an ambitious \
-experiment to win a Congress committed to ending corruption in 2016, and we did something amazing: \
-we raised $1 million dollars in 12 days. That's a ton of money, but it's not enough.
-
-We're raising $5 million more by July 4, and I'm writing to my friends and family to \
-ask if you can help us get the rest of the way there. If all of us who have supported \
-the campaign so far each recruit just five matching pledges, we'd easily hit that goal. \
-But I'd like to see if I can recruit ten of my friends to donate. So my question is: \
-will you be one of those ten?
-
-"""
+# how many slug prefixes an instance allocates from the datastore at once
+SLUG_ID_BLOCK_SIZE = 100
+
+# keyword arguments passed to markdown for team descriptions. part of the
+# rendered description cache key, so changing them invalidates old entries.
+MARKDOWN_CONFIG = {}
+# bump, along with Team.CURRENT_VERSION, when MARKDOWN_CONFIG or the
+# markdown package change what descriptions render to
+DESCRIPTION_RENDERER_VERSION = 1
+DESCRIPTION_CACHE_SIZE = 512
+DESCRIPTION_CACHE_TTL = 7 * 24 * 60 * 60
+
+# bump when a template change should invalidate pages cached by browsers
+# and front-end caches (see BaseHandler.not_modified)
+TEMPLATE_VERSION = 1
+PUBLIC_PAGE_MAX_AGE = 60
+
+# leaderboard snapshots older than this are served while a task refreshes
+# them. the views in LEADERBOARD_WARM_VIEWS are refreshed by cron.yaml.
+LEADERBOARD_FRESH_SECONDS = 60
+LEADERBOARD_CACHE_TTL = 24 * 60 * 60
+# the last leaderboard fetched for a view is kept longer, for when a cold
+# miss finds the pledge service down
+LEADERBOARD_LAST_GOOD_TTL = 7 * 24 * 60 * 60
+UNAVAILABLE_RETRY_AFTER = 30
+# snapshots hold LEADERBOARD_BLOCK_SIZE rows each, and only the first
+# LEADERBOARD_MAX_ROWS rows of an ordering are served, so there are at most
+# a few snapshots per ordering however deep crawlers page
+LEADERBOARD_BLOCK_SIZE = 100
+LEADERBOARD_MAX_ROWS = 1000
+LEADERBOARD_WARM_VIEWS = [
+    (0, "-num_pledges"),  # /login
+    (0, "-totalCents")]  # /leaderboard
+# the Team fields the leaderboard shows are cached per team key
+LEADERBOARD_TEAM_PREFIX = "leaderboard_team:"
+LEADERBOARD_TEAM_TTL = 60 * 60
+# the most rows a ?limit= can ask for in one leaderboard page
+LEADERBOARD_MAX_LIMIT = 100
+
+# the Team properties site admin exports read, see teamExportQuery
+TEAM_EXPORT_FIELDS = ("title", "primary_slug", "zip_code", "user_token",
+                      "creation_time", "modification_time", "team_version")
+
+# slug -> (team key, primary slug) resolutions used by TeamBaseHandler, see
+# SlugCache. other instances pick up a new primary slug after the local ttl.
+SLUG_CACHE_SIZE = 2048
+SLUG_CACHE_LOCAL_TTL = 60
+SLUG_CACHE_TTL = 24 * 60 * 60
+# whole Team entities for the read only team pages, dropped by teamSaved
+TEAM_CACHE_PREFIX = "team:"
+TEAM_CACHE_TTL = 60 * 60
+
+# pledge counts and cents per team, counted from the pledge webhook into
+# TEAM_TOTALS_SHARDS shards and folded into TeamTotals by cron.yaml. compaction
+# is one xg transaction over all the shards, so keep it under 25.
+TEAM_TOTALS_SHARDS = 20
+TEAM_TOTALS_PREFIX = "team_totals:"
+TEAM_TOTALS_TTL = 60
+# each instance ranks every team locally from those totals (see
+# LeaderboardIndex), picking up counter changes at most this often. changes
+# are re-read for an overlap window, since the queries finding them are
+# eventually consistent.
+LEADERBOARD_INDEX_SYNC_SECONDS = 10
+LEADERBOARD_INDEX_SYNC_OVERLAP = datetime.timedelta(seconds=60)
 
 PREVIOUS_PLEDGE_DESC = u"""\
 I recently joined Lessig's citizen-funded MAYDAY.US campaign, an ambitious \
@@ -64,30 +112,27 @@ will you be one of those ten?
 {signature}
 """
 
-DEFAULT_THANKYOU_SUBJECT = u"""
-Thank You For Pledging to My Mayday PAC Page
-"""
-
-DEFAULT_THANKYOU_MESSAGE = u"""
-Thank you for pledging in support of Mayday's campaign to get money out of politics. \
-
-You can reach me by replying to this email.
-"""
-
-
 class BaseHandler(webapp2.RequestHandler):
+  # pages with lazy_auth render without asking the auth service and load
+  # the login dependent parts from AuthStateHandler (includes/lazy_auth.html)
+  lazy_auth = False
+
   def dispatch(self, *args, **kwargs):
     if self.request.host == "my.mayone.us" and self.request.method == "GET":
       self.request.host = "my.mayday.us"
       return self.redirect(self.request.url)
     return webapp2.RequestHandler.dispatch(self, *args, **kwargs)
 
-  @webapp2.cached_property
-  def auth_response(self):
+  @property
+  def return_to(self):
     if config_NOCOMMIT.auth_service.requires_https:
       self.request.scheme = "https"
+    return self.request.url
+
+  @webapp2.cached_property
+  def auth_response(self):
     return config_NOCOMMIT.auth_service.getAuthResponse(
-        self.request.cookies.get("auth", ""), self.request.url)
+        self.request.cookies.get("auth", ""), self.return_to)
 
   @property
   def logged_in(self):
@@ -103,16 +148,20 @@ class BaseHandler(webapp2.RequestHandler):
 
   @property
   def logout_link(self):
-    if config_NOCOMMIT.auth_service.requires_https:
-      self.request.scheme = "https"
-    return config_NOCOMMIT.auth_service.getLogoutLink(self.request.url)
+    return config_NOCOMMIT.auth_service.getLogoutLink(self.return_to)
 
   @property
   def pledge_root_url(self):
     return config_NOCOMMIT.PLEDGE_SERVICE_URL
 
   def render_template(self, template, **kwargs):
-    if self.logged_in:
+    if self.lazy_auth:
+      data = {
+        "lazy_auth": True,
+        "logged_in": False,
+        "pledge_root_url": self.pledge_root_url,
+        "current_url": self.request.url}
+    elif self.logged_in:
       data = {
         "logged_in": True,
         "current_user": self.current_user,
@@ -132,9 +181,38 @@ class BaseHandler(webapp2.RequestHandler):
     self.response.status = 404
     self.render_template("404.html")
 
+  def handle_exception(self, exception, debug):
+    # the pledge service's circuit breaker is open
+    if isinstance(exception, httpclient.CircuitOpen):
+      self.response.clear()
+      self.response.status = 503
+      self.response.headers["Retry-After"] = str(UNAVAILABLE_RETRY_AFTER)
+      return self.render_template("unavailable.html")
+    return webapp2.RequestHandler.handle_exception(self, exception, debug)
+
+  def not_modified(self, *parts):
+    """Sets a strong ETag made from parts, the template version and the
+    url, and cache headers. Returns True, with a 304 status, when the client
+    already has the page.
+    """
+    self.response.etag = hashlib.sha1(repr(
+        (TEMPLATE_VERSION, self.request.url) + parts)).hexdigest()
+    if self.lazy_auth and not self.request.cookies.get("auth"):
+      self.response.cache_control = "public, max-age=%d" % (
+          PUBLIC_PAGE_MAX_AGE)
+    else:
+      self.response.cache_control = "private, no-cache"
+    if self.response.etag in self.request.if_none_match:
+      self.response.status = 304
+      return True
+    return False
+
 
 class Team(db.Model):
-  CURRENT_VERSION = 2
+  # version 3 teams have description_html. bump it together with
+  # DESCRIPTION_RENDERER_VERSION so /tasks/migrate/description_html
+  # re-renders every team.
+  CURRENT_VERSION = 3
 
   primary_slug = db.StringProperty()
   title = db.StringProperty(required=True)
@@ -153,6 +231,10 @@ class Team(db.Model):
 
   team_version = db.IntegerProperty(default=1)
 
+  # description rendered by DESCRIPTION_RENDERER_VERSION of the renderer
+  description_html = db.TextProperty()
+  description_html_version = db.IntegerProperty()
+
   creation_time = db.DateTimeProperty(auto_now_add=True)
   modification_time = db.DateTimeProperty(auto_now=True)
 
@@ -160,89 +242,221 @@ class Team(db.Model):
   def create(cls, **kwargs):
     kwargs["team_version"] = cls.CURRENT_VERSION
     team = cls(**kwargs)
+    team.renderDescription()
     team.put()
     return team
 
+  def renderDescription(self):
+    """Stores the rendered description; call before putting a changed
+    description.
+    """
+    self.description_html = DESCRIPTION_CACHE.get(self.description)
+    self.description_html_version = DESCRIPTION_RENDERER_VERSION
+    self.team_version = self.CURRENT_VERSION
 
-class YoutubeIdField(wtforms.Field):
-  widget = URLInput()
+  def needsUpgrade(self):
+    return (self.team_version < self.CURRENT_VERSION or
+            self.description_html is None or
+            self.description_html_version != DESCRIPTION_RENDERER_VERSION)
 
-  def __init__(self, label=None, validators=None, **kwargs):
-    wtforms.Field.__init__(self, label, validators, **kwargs)
+  # the properties renderDescription sets
+  RENDERED_PROPERTIES = ("description_html", "description_html_version",
+                         "team_version")
 
-  def _value(self):
-    if self.data is not None:
-      return u"https://www.youtube.com/watch?v=%s" % unicode(self.data)
-    else:
-      return ''
+  @staticmethod
+  @db.transactional
+  def _upgrade(team_key):
+    # written without the model, so modification_time keeps the last edit
+    try:
+      entity = datastore.Get(team_key)
+    except datastore_errors.EntityNotFoundError:
+      return False
+    team = Team.from_entity(entity)
+    if not team.needsUpgrade():
+      return False
+    team.renderDescription()
+    for name in Team.RENDERED_PROPERTIES:
+      entity[name] = Team.properties()[name].get_value_for_datastore(team)
+    datastore.Put(entity)
+    return True
 
-  def process_formdata(self, valuelist):
-    self.data = None
-    if valuelist:
-      parsed = urlparse.urlparse(valuelist[0])
-      if "youtube.com" not in parsed.netloc:
-        raise ValueError(self.gettext("Not a valid Youtube URL"))
-      video_args = urlparse.parse_qs(parsed.query).get("v")
-      if len(video_args) != 1:
-        raise ValueError(self.gettext("Not a valid Youtube URL"))
-      youtube_id = video_args[0]
-      if not YOUTUBE_ID_VALIDATOR.match(youtube_id):
-        raise ValueError(self.gettext("Not a valid Youtube URL"))
-      self.data = youtube_id
+  @staticmethod
+  def upgrade(team_key):
+    """Renders and stores the description of the team with team_key if it
+    is missing or out of date.
+    """
+    if Team._upgrade(team_key):
+      memcache.delete_multi([str(team_key)], key_prefix=TEAM_CACHE_PREFIX)
+
+  def descriptionHtml(self):
+    """The rendered description. Teams saved before description_html, or
+    with an older renderer version, are rendered and upgraded here.
+    """
+    if not self.needsUpgrade():
+      return self.description_html
+    html = DESCRIPTION_CACHE.get(self.description)
+    try:
+      Team.upgrade(self.key())
+    except db.Error as e:
+      logging.error('Exception storing description html: ' + str(e))
+    return html
 
 
-class ZipcodeField(wtforms.Field):
+class DescriptionCache(object):
+  """Caches rendered team description HTML in process (LRU) and in memcache,
+  keyed by a hash of the description plus the markdown configuration.
   """
-  A text field, except all input is coerced to an integer.  Erroneous input
-  is ignored and will not be accepted as a value.
+
+  def __init__(self, size, ttl, markdown_config):
+    self.size = size
+    self.ttl = ttl
+    self.markdown_config = markdown_config
+    self._config_hash = hashlib.sha1(
+        repr(sorted(markdown_config.items()))).hexdigest()
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.stats = {"hits": 0, "memcache_hits": 0, "misses": 0}
+
+  def _key(self, description):
+    return "description:%s:%s" % (
+        self._config_hash,
+        hashlib.sha1(description.encode("utf-8")).hexdigest())
+
+  def _count(self, stat):
+    with self._lock:
+      self.stats[stat] += 1
+
+  def _remember(self, key, html):
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = html
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+  def _render(self, description):
+    # loaded on the first render; importing markdown loads all its processors
+    import markdown
+    return markdown.markdown(jinja2.escape(description),
+                             **self.markdown_config)
+
+  def fill(self, description):
+    """Renders description and stores it in both cache levels."""
+    key = self._key(description)
+    html = self._render(description)
+    self._remember(key, html)
+    memcache.set(key, html, self.ttl)
+    return html
+
+  def get(self, description):
+    """Returns the rendered HTML for description, rendering on a miss."""
+    key = self._key(description)
+    with self._lock:
+      html = self._entries.get(key)
+      if html is not None:
+        self._entries[key] = self._entries.pop(key)
+        self.stats["hits"] += 1
+        return html
+    html = memcache.get(key)
+    if html is not None:
+      self._count("memcache_hits")
+      self._remember(key, html)
+      return html
+    self._count("misses")
+    return self.fill(description)
+
+
+DESCRIPTION_CACHE = DescriptionCache(
+    DESCRIPTION_CACHE_SIZE, DESCRIPTION_CACHE_TTL, MARKDOWN_CONFIG)
+
+
+def teamSaved(team):
+  """Updates the caches of a team's derived data after it is put."""
+  memcache.delete_multi([str(team.key())], key_prefix=LEADERBOARD_TEAM_PREFIX)
+  memcache.delete_multi([str(team.key())], key_prefix=TEAM_CACHE_PREFIX)
+  SLUG_CACHE.invalidate(team)
+  UserTeams.teamChanged(team)
+
+
+# config_NOCOMMIT can set a pledge.LocalMailchimpQueue for tests
+MAILCHIMP_QUEUE = (getattr(config_NOCOMMIT, "mailchimp_queue", None) or
+                   pledge.TaskQueueMailchimpQueue())
+
+
+def enqueueMailchimpUpdate(team):
+  """Queues a mailchimp update for a saved team. The team is saved either
+  way, so a failure to queue is logged rather than failing the request.
   """
-  widget = wtforms.widgets.TextInput()
+  try:
+    MAILCHIMP_QUEUE.enqueue(str(team.key()))
+  except Exception as e:
+    logging.error('Exception enqueueing mailChimp update: ' + str(e))
 
-  def __init__(self, label=None, validators=None, **kwargs):
-    wtforms.Field.__init__(self, label, validators, **kwargs)
 
-  def _value(self):
-    if self.data is not None:
-      return unicode(self.data)
-    else:
-      return ''
-
-  def process_formdata(self, valuelist):
-    self.data = None
-    if valuelist:
-      try:
-        int(valuelist[0])
-      except ValueError:
-        self.data = None
-        raise ValueError(self.gettext('Not a valid integer value'))
-      else:
-        self.data = valuelist[0]
+def updateMailchimp(team_key):
+  """Sends the current primary slug of a team to mailchimp. Raises when the
+  pledge service fails, so the update is retried.
+  """
+  MAILCHIMP_QUEUE.started(team_key)
+  team = Team.get(db.Key(team_key))
+  if team is None:
+    return
+  result = config_NOCOMMIT.pledge_service.updateMailchimp(team)
+  if result is not None and result.status_code >= 500:
+    raise Exception("unexpected mailchimp error %d: %s" % (
+        result.status_code, result.content))
+
+
+def getCachedTeam(team_key):
+  """Returns the Team with key team_key (a string), from memcache if
+  possible. Only for reads; handlers that put the team should Team.get it.
+  """
+  encoded = memcache.get(TEAM_CACHE_PREFIX + team_key)
+  if encoded is not None:
+    return db.model_from_protobuf(encoded)
+  team = Team.get(db.Key(team_key))
+  if team is not None:
+    memcache.set(TEAM_CACHE_PREFIX + team_key,
+                 db.model_to_protobuf(team).Encode(), TEAM_CACHE_TTL)
+  return team
+
+
+class SlugPrefixes(object):
+  """Hands out unique slug prefixes from blocks of ids allocated by the
+  datastore, so a new slug needs no transaction and no collision retries.
+
+  The SlugPrefix key only names an id sequence: allocate_ids reserves a
+  range from it without reading or writing an entity, so instances
+  allocating at once don't contend the way writes to one counter entity
+  would. Each instance makes one allocate_ids call per block_size slugs,
+  and handing out ids from its block takes only a local lock.
+  """
 
+  def __init__(self, block_size):
+    self.block_size = block_size
+    self._lock = threading.Lock()
+    self._next = self._end = 0
 
-class TeamForm(wtforms.Form):
-  title = wtforms.StringField("Your Name", [
-      wtforms.validators.Length(min=1, max=500)], default=DEFAULT_TITLE)
-  description = wtforms.TextAreaField("Your Personal Message",
-      [wtforms.validators.Length(min=1)],
-      default=DEFAULT_DESC.format(title=DEFAULT_TITLE))
+  @staticmethod
+  def format(slug_id):
+    # slugs made before used os.urandom prefixes, which are always an even
+    # number of hex digits. these are always odd, so they can't collide.
+    prefix = "%x" % slug_id
+    if len(prefix) % 2 == 0:
+      prefix = "0" + prefix
+    return prefix
 
-  goal_dollars = IntegerField("Goal", [wtforms.validators.optional()])
-  youtube_id = YoutubeIdField("Youtube Video URL", [
-      wtforms.validators.optional()])
-  zip_code = ZipcodeField("Zip Code", [wtforms.validators.optional()])
+  def next(self):
+    with self._lock:
+      if self._next >= self._end:
+        start, end = db.allocate_ids(
+            db.Key.from_path("SlugPrefix", 1), self.block_size)
+        self._next, self._end = start, end + 1
+      slug_id = self._next
+      self._next += 1
+    return self.format(slug_id)
 
 
-class ThankYouForm(wtforms.Form):
-  reply_to = wtforms.StringField("Your Email Address", [
-    wtforms.validators.Email(message='Please enter a valid email.'),
-    wtforms.validators.Length(min=1, max=100)])
-  subject = wtforms.StringField("Message Subject", [
-      wtforms.validators.Length(min=1, max=150)], default=DEFAULT_THANKYOU_SUBJECT)
-  message_body = wtforms.TextAreaField("Message Body",
-      [wtforms.validators.Length(min=1, max=10000)],
-      default=DEFAULT_THANKYOU_MESSAGE)
-  new_members = wtforms.BooleanField("Send to new contributors only (have not \
-    previsously received a thank you message)", [], default=True)
+SLUG_PREFIXES = SlugPrefixes(SLUG_ID_BLOCK_SIZE)
 
 
 class Slug(db.Model):
@@ -250,25 +464,107 @@ class Slug(db.Model):
   team = db.ReferenceProperty(Team, required=True)
 
   @staticmethod
-  @db.transactional
-  def _make(full_slug, team):
-    e = Slug.get_by_key_name(full_slug)
-    if e is not None:
-      return False
-    Slug(key_name=full_slug, team=team).put()
-    return True
+  def slugName(title):
+    slug_name = MULTIDASH_RE.sub('-', INVALID_SLUG_CHARS.sub('-', title))
+    return slug_name.rstrip('-')
 
   @staticmethod
   def new(team):
-    slug_name = MULTIDASH_RE.sub('-', INVALID_SLUG_CHARS.sub('-', team.title))
-    slug_name = slug_name.rstrip('-')
-    token_amount = SLUG_TOKEN_AMOUNT
-    while True:
-      slug_prefix = os.urandom(token_amount).encode('hex')
-      token_amount += 1
-      full_slug = "%s-%s" % (slug_prefix, slug_name)
-      if Slug._make(full_slug, team):
-        return full_slug
+    """Returns a primary slug for team. Keeps team's current one if its
+    title still makes the same slug name.
+    """
+    slug_name = Slug.slugName(team.title)
+    if (team.primary_slug and
+        team.primary_slug.split('-', 1)[-1] == slug_name):
+      return team.primary_slug
+    full_slug = "%s-%s" % (SLUG_PREFIXES.next(), slug_name)
+    Slug(key_name=full_slug, team=team).put()
+    return full_slug
+
+
+class SlugCache(object):
+  """Resolves slug names to the key and primary slug of their team, in
+  process (LRU, expiring after local_ttl) and in memcache. Unknown slugs are
+  not cached.
+  """
+
+  def __init__(self, size, local_ttl, ttl):
+    self.size = size
+    self.local_ttl = local_ttl
+    self.ttl = ttl
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.stats = {"hits": 0, "memcache_hits": 0, "misses": 0,
+                  "invalidations": 0}
+
+  @staticmethod
+  def _key(slug):
+    return "slug:%s" % slug
+
+  def _count(self, stat):
+    with self._lock:
+      self.stats[stat] += 1
+
+  def _remember(self, slug, resolved):
+    with self._lock:
+      self._entries.pop(slug, None)
+      self._entries[slug] = (time.time() + self.local_ttl, resolved)
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+  def get(self, slug):
+    """Returns (team key string, primary slug) for slug, or None if there
+    is no such slug or team.
+    """
+    with self._lock:
+      entry = self._entries.get(slug)
+      if entry is not None and entry[0] > time.time():
+        self._entries[slug] = self._entries.pop(slug)
+        self.stats["hits"] += 1
+        return entry[1]
+    resolved = memcache.get(self._key(slug))
+    if resolved is not None:
+      self._count("memcache_hits")
+      self._remember(slug, resolved)
+      return resolved
+    self._count("misses")
+    s = Slug.get_by_key_name(slug)
+    if s is None:
+      return None
+    team = s.team
+    if team is None:
+      return None
+    resolved = (str(team.key()), team.primary_slug)
+    memcache.set(self._key(slug), resolved, self.ttl)
+    self._remember(slug, resolved)
+    return resolved
+
+  def forget(self, slug):
+    """Drops slug from the in process cache and memcache."""
+    memcache.delete(self._key(slug))
+    with self._lock:
+      self._entries.pop(slug, None)
+
+  def invalidate(self, team):
+    """Forgets the resolutions of all of team's slugs, after its primary
+    slug changed.
+    """
+    slugs = set(s.name() for s in
+                Slug.all(keys_only=True).filter("team =", team))
+    # the slug query is eventually consistent, so a just made primary slug
+    # may be missing from it
+    if team.primary_slug:
+      slugs.add(team.primary_slug)
+    memcache.delete_multi([self._key(slug) for slug in slugs])
+    team_key = str(team.key())
+    with self._lock:
+      for slug, (_, resolved) in self._entries.items():
+        if resolved[0] == team_key:
+          del self._entries[slug]
+      self.stats["invalidations"] += 1
+
+
+SLUG_CACHE = SlugCache(SLUG_CACHE_SIZE, SLUG_CACHE_LOCAL_TTL, SLUG_CACHE_TTL)
 
 
 class AdminToTeam(db.Model):
@@ -278,9 +574,196 @@ class AdminToTeam(db.Model):
   user = db.StringProperty(required=True)  # from current_user["user_id"]
   team = db.ReferenceProperty(Team, required=True)
 
+
+class UserTeams(db.Model):
+  """The teams a user is an admin of, denormalized from AdminToTeam so the
+  dashboard and admin checks are one keyed get. The key is the user id and
+  the lists are parallel: teams[i] has titles[i] and slugs[i].
+
+  Indexes are only written when admins are added or removed, and for
+  existing AdminToTeam rows by MigrateUserTeamsTask.
+  """
+  teams = db.ListProperty(db.Key)
+  titles = db.StringListProperty()
+  slugs = db.StringListProperty()
+
+  def memberships(self):
+    return [{"key": key, "title": title, "primary_slug": slug}
+            for key, title, slug in zip(self.teams, self.titles, self.slugs)]
+
+  def _discard(self, team_key):
+    if team_key in self.teams:
+      idx = self.teams.index(team_key)
+      del self.teams[idx], self.titles[idx], self.slugs[idx]
+
+  def _set(self, team):
+    if team.key() in self.teams:
+      idx = self.teams.index(team.key())
+      self.titles[idx] = team.title
+      self.slugs[idx] = team.primary_slug or ""
+    else:
+      self.teams.append(team.key())
+      self.titles.append(team.title)
+      self.slugs.append(team.primary_slug or "")
+
+  @staticmethod
+  @db.transactional
+  def merge(user_id, teams):
+    """Adds teams to user_id's index, or refreshes their title and slug."""
+    index = UserTeams.get_by_key_name(user_id)
+    if index is None:
+      index = UserTeams(key_name=user_id)
+    for team in teams:
+      index._set(team)
+    index.put()
+    return index
+
+  @staticmethod
+  @db.transactional
+  def discard(user_id, team_key):
+    """Removes a team from user_id's index."""
+    index = UserTeams.get_by_key_name(user_id)
+    if index is not None and team_key in index.teams:
+      index._discard(team_key)
+      index.put()
+
+  @staticmethod
+  def adminTeams(user_id):
+    """Returns the Teams AdminToTeam makes user_id an admin of."""
+    team_keys = [AdminToTeam.team.get_value_for_datastore(a) for a in
+                 AdminToTeam.all().filter("user =", user_id)]
+    return [team for team in Team.get(team_keys) if team is not None]
+
+  @staticmethod
+  def forUser(user_id):
+    """Returns the index for user_id without saving anything. Until
+    MigrateUserTeamsTask has indexed every AdminToTeam row, a user without
+    an index gets one built from AdminToTeam.
+    """
+    index = UserTeams.get_by_key_name(user_id)
+    if index is None:
+      index = UserTeams(key_name=user_id)
+      if not migrationDone(USER_TEAMS_MIGRATION):
+        for team in UserTeams.adminTeams(user_id):
+          index._set(team)
+    return index
+
+  @staticmethod
+  def teamChanged(team):
+    """Refreshes the title and slug of team in its admins' indexes."""
+    for key in UserTeams.all(keys_only=True).filter("teams =", team.key()):
+      UserTeams.merge(key.name(), [team])
+
+
+class ThankJob(db.Model):
+  """A thank you message to a team's contributors, sent by ThankTask in
+  batches of the pledge service's THANK_BATCH_SIZE pledges. After the first
+  batch reports total_pledges the other batches run concurrently, each
+  adding to num_emailed when done.
+  """
+  team = db.ReferenceProperty(Team, required=True)
+  reply_to = db.StringProperty()
+  # ThankYouForm allows newlines, and DEFAULT_THANKYOU_SUBJECT has them
+  subject = db.StringProperty(multiline=True)
+  message_body = db.TextProperty()
+  new_members = db.BooleanProperty()
+
+  status = db.StringProperty(default="running")  # running, done or failed
+  error = db.TextProperty()
+  num_emailed = db.IntegerProperty(default=0)
+  total_pledges = db.IntegerProperty()
+  batches_total = db.IntegerProperty()
+  done_offsets = db.ListProperty(int)
+
+  creation_time = db.DateTimeProperty(auto_now_add=True)
+
+  def formData(self):
+    return {"reply_to": self.reply_to,
+            "subject": self.subject,
+            "message_body": self.message_body,
+            "new_members": self.new_members}
+
+  def progress(self):
+    return {"status": self.status,
+            "error": self.error,
+            "num_emailed": self.num_emailed,
+            "total_pledges": self.total_pledges,
+            "batches_done": len(self.done_offsets),
+            "batches_total": self.batches_total}
+
+  def pendingOffsets(self, batch_size):
+    """The offsets of the batches that have not finished, once the first
+    batch told us total_pledges.
+    """
+    if self.total_pledges is None or not batch_size:
+      return []
+    return [offset for offset in
+            xrange(batch_size, self.total_pledges, batch_size)
+            if offset not in self.done_offsets]
+
   @staticmethod
-  def memcacheKey(user_id, team):
-    return repr((str(user_id), str(team.key())))
+  @db.transactional
+  def batchDone(job_key, offset, result, batch_size):
+    job = ThankJob.get(job_key)
+    if job.status != "running" or offset in job.done_offsets:
+      return job
+    job.done_offsets.append(offset)
+    job.num_emailed += result["num_emailed"]
+    if job.total_pledges is None:
+      job.total_pledges = result["total_pledges"]
+      job.batches_total = 1 + len(job.pendingOffsets(batch_size))
+    if len(job.done_offsets) >= job.batches_total:
+      job.status = "done"
+    job.put()
+    return job
+
+  @staticmethod
+  @db.transactional
+  def failed(job_key, error):
+    job = ThankJob.get(job_key)
+    job.status = "failed"
+    job.error = error
+    job.put()
+
+
+class ThankBatch(db.Model):
+  """A batch of a ThankJob, claimed before its emails are sent and then
+  given the pledge service's result, so a retried ThankTask records the
+  batch without sending it again. The key name is "<job id>:<offset>", one
+  entity group per batch.
+  """
+  sent = db.BooleanProperty(default=False)
+  num_emailed = db.IntegerProperty()
+  total_pledges = db.IntegerProperty()
+
+  @staticmethod
+  def keyName(job_id, offset):
+    return "%d:%d" % (job_id, offset)
+
+  @staticmethod
+  @db.transactional
+  def claim(job_id, offset):
+    """Returns None once the caller holds the batch, or the batch an
+    earlier attempt claimed.
+    """
+    key_name = ThankBatch.keyName(job_id, offset)
+    batch = ThankBatch.get_by_key_name(key_name)
+    if batch is not None:
+      return batch
+    ThankBatch(key_name=key_name).put()
+    return None
+
+  def result(self):
+    return {"num_emailed": self.num_emailed,
+            "total_pledges": self.total_pledges}
+
+
+def formsModule():
+  """Returns the forms module, imported on first use since loading wtforms
+  is a good part of the instance startup cost.
+  """
+  import forms
+  return forms
 
 
 def require_login(fn):
@@ -300,31 +783,510 @@ class IndexHandler(BaseHandler):
     return self.redirect("/login")
 
 
-def leaderboardGetter(offset, limit, orderBy):
-  leaderboard = config_NOCOMMIT.pledge_service.getLeaderboard(
-      offset=offset, limit=limit, orderBy=orderBy)
+class LeaderboardCache(object):
+  """Serves pledge service leaderboards from snapshots in memcache of
+  block_size rows each, keyed by (block, orderBy); a page is sliced from the
+  blocks it overlaps. Rows past max_rows are not served. Stale snapshots
+  are served while a task queue task refreshes them, so only a cold miss
+  waits on the pledge service.
+  """
+
+  def __init__(self, fresh_seconds, ttl, last_good_ttl, block_size,
+               max_rows):
+    self.fresh_seconds = fresh_seconds
+    self.ttl = ttl
+    self.last_good_ttl = last_good_ttl
+    self.block_size = block_size
+    self.max_rows = max_rows
+    self._lock = threading.Lock()
+    self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0,
+                  "last_good_hits": 0, "degraded": 0,
+                  "last_age_seconds": None}
+
+  @staticmethod
+  def _key(block, orderBy):
+    return "leaderboard:%d:%s" % (block, orderBy)
+
+  def _count(self, stat, age=None):
+    with self._lock:
+      self.stats[stat] += 1
+      self.stats["last_age_seconds"] = age
+
+  def refresh(self, block, orderBy):
+    """Fetches a block of a leaderboard from the pledge service and stores
+    a snapshot.
+    """
+    rows = config_NOCOMMIT.pledge_service.getLeaderboard(
+        offset=block * self.block_size, limit=self.block_size,
+        orderBy=orderBy)
+    key = self._key(block, orderBy)
+    snapshot = {"rows": rows, "time": time.time()}
+    memcache.set(key, snapshot, self.ttl)
+    memcache.set(key + ":last_good", snapshot, self.last_good_ttl)
+    self._count("refreshes")
+    return rows
+
+  def _enqueueRefresh(self, block, orderBy):
+    # one refresh task per snapshot at a time
+    if not memcache.add(self._key(block, orderBy) + ":refreshing",
+                        True, self.fresh_seconds):
+      return
+    try:
+      taskqueue.add(url="/tasks/leaderboard/refresh", params={
+          "block": block, "orderBy": orderBy})
+    except Exception as e:
+      logging.error('Exception enqueueing leaderboard refresh: ' + str(e))
+
+  def get(self, offset, limit, orderBy):
+    """Returns the rows of a page, cut short at max_rows."""
+    end = min(offset + limit, self.max_rows)
+    rows = []
+    first = offset // self.block_size
+    for block in xrange(first, (end - 1) // self.block_size + 1):
+      block_rows = self._block(block, orderBy)
+      rows.extend(block_rows)
+      if len(block_rows) < self.block_size:
+        # the end of the leaderboard
+        break
+    start = offset - first * self.block_size
+    return rows[start:start + max(end - offset, 0)]
+
+  def _block(self, block, orderBy):
+    snapshot = memcache.get(self._key(block, orderBy))
+    if snapshot is None:
+      self._count("misses")
+      try:
+        return self.refresh(block, orderBy)
+      except Exception as e:
+        logging.error('Exception refreshing leaderboard: ' + str(e))
+      snapshot = memcache.get(self._key(block, orderBy) + ":last_good")
+      if snapshot is None:
+        # degraded: the page renders without the leaderboard
+        self._count("degraded")
+        return []
+      self._count("last_good_hits", time.time() - snapshot["time"])
+      return snapshot["rows"]
+    age = time.time() - snapshot["time"]
+    if age > self.fresh_seconds:
+      self._count("stale_hits", age)
+      self._enqueueRefresh(block, orderBy)
+    else:
+      self._count("hits", age)
+    return snapshot["rows"]
+
+
+LEADERBOARD_CACHE = LeaderboardCache(
+    LEADERBOARD_FRESH_SECONDS, LEADERBOARD_CACHE_TTL,
+    LEADERBOARD_LAST_GOOD_TTL, LEADERBOARD_BLOCK_SIZE, LEADERBOARD_MAX_ROWS)
+
+
+class TeamTotals(db.Model):
+  """A team's pledge totals as of the last compaction. The key name is the
+  team key; pledges since then are in its TeamTotalsShards.
+  """
+  cents = db.IntegerProperty(default=0)
+  pledges = db.IntegerProperty(default=0)
+  compaction_time = db.DateTimeProperty(auto_now=True)
+
+
+class TeamTotalsShard(db.Model):
+  """Pledges added to a team since the last compaction, spread over
+  TEAM_TOTALS_SHARDS entities so a popular team's writes don't contend.
+  The key name is "<team key>:<shard>".
+  """
+  team = db.StringProperty(required=True)
+  cents = db.IntegerProperty(default=0)
+  pledges = db.IntegerProperty(default=0)
+  updated = db.DateTimeProperty(auto_now=True)
+
+
+class PledgeEvent(db.Model):
+  """A pledge already counted, keyed by the pledge service's pledge id, so
+  webhook retries and replays count it once.
+  """
+  team = db.StringProperty()
+  cents = db.IntegerProperty()
+  pledges = db.IntegerProperty()
+  time = db.DateTimeProperty(auto_now_add=True)
+
+
+XG_TRANSACTION = db.create_transaction_options(xg=True)
+
+
+def _teamTotalsKeys(team_key):
+  return [db.Key.from_path("TeamTotals", team_key)] + [
+      db.Key.from_path("TeamTotalsShard", "%s:%d" % (team_key, shard))
+      for shard in xrange(TEAM_TOTALS_SHARDS)]
+
+
+def addPledge(team_key, pledge_id, cents, pledges=1):
+  """Adds a pledge to a team's totals, unless pledge_id was already counted.
+  Returns whether it was counted.
+  """
+  shard_name = "%s:%d" % (team_key, random.randrange(TEAM_TOTALS_SHARDS))
+
+  def txn():
+    if PledgeEvent.get_by_key_name(pledge_id) is not None:
+      return False
+    shard = (TeamTotalsShard.get_by_key_name(shard_name) or
+             TeamTotalsShard(key_name=shard_name, team=team_key))
+    shard.cents += cents
+    shard.pledges += pledges
+    db.put([shard, PledgeEvent(key_name=pledge_id, team=team_key,
+                               cents=cents, pledges=pledges)])
+    return True
+
+  counted = db.run_in_transaction_options(XG_TRANSACTION, txn)
+  if counted:
+    memcache.delete(TEAM_TOTALS_PREFIX + team_key)
+  return counted
+
+
+def readTeamTotals(team_keys):
+  """Returns a dict from team key string to (cents, pledges), summed from
+  TeamTotals and its shards in the datastore.
+  """
+  entities = db.get(sum((_teamTotalsKeys(key) for key in team_keys), []))
+  per_team = TEAM_TOTALS_SHARDS + 1
+  totals = {}
+  for i, key in enumerate(team_keys):
+    parts = [e for e in entities[i * per_team:(i + 1) * per_team] if e]
+    totals[key] = (sum(e.cents for e in parts),
+                   sum(e.pledges for e in parts))
+  return totals
+
+
+def getCachedTeamTotals(team_keys):
+  """readTeamTotals through memcache. Not to be confused with the pledge
+  service's getTeamTotals, which takes teams and returns a list.
+  """
+  totals = memcache.get_multi(team_keys, key_prefix=TEAM_TOTALS_PREFIX)
+  missing = [key for key in team_keys if key not in totals]
+  if missing:
+    fetched = readTeamTotals(missing)
+    memcache.set_multi(fetched, key_prefix=TEAM_TOTALS_PREFIX,
+                       time=TEAM_TOTALS_TTL)
+    totals.update(fetched)
+  return totals
+
+
+def compactTeamTotals(team_key):
+  """Folds a team's shards into its TeamTotals and deletes them."""
+  def txn():
+    entities = db.get(_teamTotalsKeys(team_key))
+    base = entities[0] or TeamTotals(key_name=team_key)
+    shards = [shard for shard in entities[1:] if shard is not None]
+    if not shards:
+      return
+    base.cents += sum(shard.cents for shard in shards)
+    base.pledges += sum(shard.pledges for shard in shards)
+    base.put()
+    db.delete(shards)
+  db.run_in_transaction_options(XG_TRANSACTION, txn)
+
+
+class LeaderboardSnapshot(db.Model):
+  """A LeaderboardIndex as of a time, so new instances only read the
+  counter changes since then. data is zlib compressed json of
+  [team key, cents, pledges] rows, a few tens of bytes per team.
+  """
+  data = db.BlobProperty()
+  as_of = db.DateTimeProperty()
+
+  KEY_NAME = "leaderboard"
+
+
+class LeaderboardIndex(object):
+  """Every team's totals, kept sorted for each leaderboard ordering, so a
+  page at any offset is a slice. The index loads from the
+  LeaderboardSnapshot and then applies the teams whose counters changed
+  since, at most every sync_seconds. Only the snapshot task scans every
+  team's counters: until it has saved a snapshot, page returns None.
+  """
+  ORDERINGS = {
+      "-totalCents": lambda team, cents, pledges: (-cents, -pledges, team),
+      "-num_pledges": lambda team, cents, pledges: (-pledges, -cents, team)}
+
+  def __init__(self, sync_seconds, sync_overlap):
+    self.sync_seconds = sync_seconds
+    self.sync_overlap = sync_overlap
+    self._lock = threading.Lock()
+    # held while loading or syncing, so one request at a time does it
+    self._sync_lock = threading.Lock()
+    self._totals = None  # team key -> (cents, pledges)
+    self._sorted = {}  # orderBy -> sorted list of ORDERINGS keys
+    self._as_of = None
+    self._synced = 0
+    self._missing = 0  # when a load last found no snapshot
+    self.stats = {"loads": 0, "rebuilds": 0, "syncs": 0, "updates": 0,
+                  "teams": 0}
+
+  def _count(self, stat, n=1):
+    with self._lock:
+      self.stats[stat] += n
+
+  def _replace(self, totals, as_of):
+    sorted_keys = {}
+    for orderBy, sort_key in self.ORDERINGS.iteritems():
+      sorted_keys[orderBy] = sorted(
+          sort_key(team, cents, pledges)
+          for team, (cents, pledges) in totals.iteritems())
+    with self._lock:
+      self._totals, self._sorted, self._as_of = totals, sorted_keys, as_of
+      self._synced = time.time()
+      self.stats["teams"] = len(totals)
+
+  def _update(self, totals, as_of):
+    with self._lock:
+      for team, (cents, pledges) in totals.iteritems():
+        old = self._totals.get(team)
+        if old == (cents, pledges):
+          continue
+        for orderBy, sort_key in self.ORDERINGS.iteritems():
+          keys = self._sorted[orderBy]
+          if old is not None:
+            del keys[bisect.bisect_left(keys, sort_key(team, *old))]
+          bisect.insort(keys, sort_key(team, cents, pledges))
+        self._totals[team] = (cents, pledges)
+        self.stats["updates"] += 1
+      self._as_of = as_of
+      self._synced = time.time()
+      self.stats["teams"] = len(self._totals)
+
+  def rebuild(self):
+    """Sums every team's TeamTotals and shards and saves a snapshot."""
+    as_of = datetime.datetime.utcnow()
+    totals = collections.defaultdict(lambda: (0, 0))
+    for entity in TeamTotals.all():
+      cents, pledges = totals[entity.key().name()]
+      totals[entity.key().name()] = (cents + entity.cents,
+                                     pledges + entity.pledges)
+    for shard in TeamTotalsShard.all():
+      cents, pledges = totals[shard.team]
+      totals[shard.team] = (cents + shard.cents, pledges + shard.pledges)
+    self._replace(dict(totals), as_of)
+    self._count("rebuilds")
+    self.save()
+
+  def _load(self):
+    snapshot = LeaderboardSnapshot.get_by_key_name(
+        LeaderboardSnapshot.KEY_NAME)
+    if snapshot is None:
+      return False
+    rows = json.loads(zlib.decompress(snapshot.data))
+    self._replace(dict((team, (cents, pledges))
+                       for team, cents, pledges in rows), snapshot.as_of)
+    self._count("loads")
+    self.sync()
+    return True
+
+  def save(self):
+    with self._lock:
+      rows = [[team, cents, pledges]
+              for team, (cents, pledges) in self._totals.iteritems()]
+      as_of = self._as_of
+    LeaderboardSnapshot(key_name=LeaderboardSnapshot.KEY_NAME,
+                        data=zlib.compress(json.dumps(rows)),
+                        as_of=as_of).put()
+
+  def sync(self):
+    """Re-reads the totals of the teams whose counters changed since the
+    index was last synced. Compaction updates TeamTotals, so shards it
+    deleted in the meantime are still found.
+    """
+    as_of = datetime.datetime.utcnow()
+    since = self._as_of - self.sync_overlap
+    teams = set(key.name() for key in TeamTotals.all(keys_only=True).filter(
+        "compaction_time >=", since))
+    teams.update(key.name().rsplit(":", 1)[0] for key in
+                 TeamTotalsShard.all(keys_only=True).filter("updated >=",
+                                                           since))
+    self._update(readTeamTotals(list(teams)) if teams else {}, as_of)
+    self._count("syncs")
+
+  def _ensureCurrent(self):
+    """Loads or syncs the index when it is due. Returns whether it is
+    loaded.
+    """
+    if self._totals is None:
+      if time.time() - self._missing < self.sync_seconds:
+        return False
+    elif time.time() - self._synced < self.sync_seconds:
+      return True
+    # the first request waits for the index, later ones serve what is there
+    # while another request syncs
+    if not self._sync_lock.acquire(self._totals is None):
+      return True
+    try:
+      if self._totals is None:
+        if not self._load():
+          self._missing = time.time()
+      elif time.time() - self._synced >= self.sync_seconds:
+        self.sync()
+    finally:
+      self._sync_lock.release()
+    return self._totals is not None
+
+  def refreshSnapshot(self):
+    """Brings the index up to date and saves it as the snapshot, rebuilding
+    it from a full scan when there is no snapshot yet.
+    """
+    with self._sync_lock:
+      if self._totals is not None:
+        self.sync()
+      elif not self._load():
+        self.rebuild()
+        return
+    self.save()
+
+  def page(self, limit, orderBy, offset=0, after=None, before=None):
+    """Returns the position of a page's first row and its rows, in the
+    pledge service's format plus each row's sort key. The page starts at
+    offset, or right after or before the sort key of a row on an earlier
+    page. Paging by key doesn't repeat rows or skip rows that kept their
+    rank when others move, but a team that climbs past the key between two
+    pages is on neither of them.
+
+    Returns None while there is no snapshot to load.
+    """
+    if not self._ensureCurrent():
+      return None
+    with self._lock:
+      keys = self._sorted[orderBy]
+      if after is not None:
+        start = bisect.bisect_right(keys, after)
+      elif before is not None:
+        start = max(bisect.bisect_left(keys, before) - limit, 0)
+      else:
+        start = offset
+      rows = [(key, self._totals[key[2]]) for key in keys[start:start + limit]]
+    return start, [{"team": key[2], "total_cents": cents,
+                    "num_pledges": pledges, "key": key}
+                   for key, (cents, pledges) in rows]
+
+
+LEADERBOARD_INDEX = LeaderboardIndex(
+    LEADERBOARD_INDEX_SYNC_SECONDS, LEADERBOARD_INDEX_SYNC_OVERLAP)
+
+
+def useLocalLeaderboard():
+  """Whether leaderboards come from LEADERBOARD_INDEX rather than the
+  pledge service, see config_NOCOMMIT_README.
+  """
+  return getattr(config_NOCOMMIT, "local_leaderboard", False)
+
+
+def getLeaderboardTeams(team_keys):
+  """Returns a dict from team key string to the title and primary_slug of
+  the team, for the teams that exist. Cached fields come from memcache and
+  the rest of the teams are fetched with one multi-key get.
+  """
+  infos = memcache.get_multi(team_keys, key_prefix=LEADERBOARD_TEAM_PREFIX)
+  missing = [key for key in team_keys if key not in infos]
+  if missing:
+    fetched = {}
+    for key, team in zip(missing, Team.get([db.Key(key) for key in missing])):
+      if team is not None:
+        fetched[key] = {"title": team.title,
+                        "primary_slug": team.primary_slug}
+    memcache.set_multi(fetched, key_prefix=LEADERBOARD_TEAM_PREFIX,
+                       time=LEADERBOARD_TEAM_TTL)
+    infos.update(fetched)
+  return infos
+
+
+def encodeLeaderboardCursor(orderBy, position, after=None, before=None):
+  """Returns an opaque cursor for the leaderboard page at position, or
+  right after or before a LeaderboardIndex sort key.
+  """
+  cursor = {"o": orderBy, "p": position}
+  if after is not None:
+    cursor["a"] = after
+  if before is not None:
+    cursor["b"] = before
+  return base64.urlsafe_b64encode(json.dumps(cursor)).rstrip("=")
+
+
+def decodeLeaderboardCursor(cursor, orderBy):
+  """Returns (position, after, before) from an encodeLeaderboardCursor
+  cursor for orderBy, or None for a cursor that isn't one.
+  """
+  try:
+    data = json.loads(base64.urlsafe_b64decode(
+        str(cursor) + "=" * (-len(cursor) % 4)))
+    if data["o"] != orderBy:
+      return None
+    keys = []
+    for name in ("a", "b"):
+      key = data.get(name)
+      if key is not None:
+        first, second, team = key
+        key = (int(first), int(second), unicode(team))
+      keys.append(key)
+    return max(int(data["p"]), 0), keys[0], keys[1]
+  except (ValueError, TypeError, KeyError, UnicodeError):
+    return None
+
+
+def leaderboardLimit(value, default):
+  """Parses a ?limit= into 1 to LEADERBOARD_MAX_LIMIT rows."""
+  try:
+    limit = int(value or default)
+  except ValueError:
+    limit = default
+  return min(max(limit, 1), LEADERBOARD_MAX_LIMIT)
+
+
+def leaderboardGetter(offset, limit, orderBy, cursor=None):
+  """Returns a leaderboard page and cursor links to its neighbours. Old
+  ?offset= links still work, but every link handed out is a cursor. The
+  pledge service's leaderboard ends after LEADERBOARD_MAX_ROWS rows.
+  """
+  after, before = None, None
+  position = decodeLeaderboardCursor(cursor, orderBy) if cursor else None
+  if position is not None:
+    offset, after, before = position
+  offset = max(offset, 0)
+  page = None
+  if useLocalLeaderboard():
+    if orderBy not in LeaderboardIndex.ORDERINGS:
+      orderBy = "-totalCents"
+    page = LEADERBOARD_INDEX.page(limit, orderBy, offset=offset, after=after,
+                                  before=before)
+  if page is not None:
+    offset, leaderboard = page
+  else:
+    # the pledge service only pages by offset, and serves until the snapshot
+    # task has built the local index
+    leaderboard = LEADERBOARD_CACHE.get(offset, limit, orderBy)
+  team_infos = getLeaderboardTeams(list(set(
+      team_data["team"] for team_data in leaderboard
+      if team_data["total_cents"] != 0)))
   teams = []
   for idx, team_data in enumerate(leaderboard):
     if team_data["total_cents"] == 0:
         continue
-    team = Team.get(db.Key(team_data["team"]))
+    team = team_infos.get(team_data["team"])
     if team is None:
       continue
     teams.append({
         "amount": int(team_data["total_cents"] / 100),
         "num_pledges":int(team_data["num_pledges"]),
-        "title": team.title,
-        "primary_slug": team.primary_slug,
+        "title": team["title"],
+        "primary_slug": team["primary_slug"],
         "position": 1 + offset + idx})
   prev_link, next_link = None, None
   if offset > 0:
     prev_link = "?%s" % urllib.urlencode({
-        "offset": max(offset - limit, 0),
+        "cursor": encodeLeaderboardCursor(
+            orderBy, max(offset - limit, 0),
+            before=leaderboard[0].get("key") if leaderboard else None),
         "limit": limit,
         "orderBy": orderBy})
   if len(teams) == limit:
     next_link = "?%s" % urllib.urlencode({
-        "offset": offset + limit,
+        "cursor": encodeLeaderboardCursor(
+            orderBy, offset + limit, after=leaderboard[-1].get("key")),
         "limit": limit,
         "orderBy": orderBy})
   return teams, prev_link, next_link
@@ -332,10 +1294,11 @@ def leaderboardGetter(offset, limit, orderBy):
 class LeaderboardHandler(BaseHandler):
   def get(self):
     offset = int(self.request.get("offset") or 0)
-    limit = int(self.request.get("limit") or 25)
+    limit = leaderboardLimit(self.request.get("limit"), 25)
     orderBy = self.request.get("orderBy") or "-totalCents"
         
-    teams, prev_link, next_link = leaderboardGetter(offset, limit, orderBy)
+    teams, prev_link, next_link = leaderboardGetter(
+        offset, limit, orderBy, self.request.get("cursor"))
     self.render_template("leaderboard.html", teams=teams,
         prev_link=prev_link, next_link=next_link, orderBy=orderBy)
 
@@ -346,45 +1309,65 @@ class LoginHandler(BaseHandler):
       return self.redirect("/dashboard")
     
     offset = int(self.request.get("offset") or 0)
-    limit = int(self.request.get("limit") or 5)
+    limit = leaderboardLimit(self.request.get("limit"), 5)
     orderBy = self.request.get("orderBy") or "-num_pledges"
     
-    teams, prev_link, next_link = leaderboardGetter(offset, limit, orderBy)
+    teams, prev_link, next_link = leaderboardGetter(
+        offset, limit, orderBy, self.request.get("cursor"))
 
     self.render_template("login.html", teams=teams,
         prev_link=prev_link, next_link=next_link, orderBy=orderBy)
 
 class NotFoundHandler(BaseHandler):
+  lazy_auth = True
+
   def get(self):
     self.notfound()
 
 
 def isUserAdmin(user_id, team):
-  return (memcache.get(AdminToTeam.memcacheKey(user_id, team)) or
-          (AdminToTeam.all().filter("team =", team).filter(
-              "user =", user_id).get() is not None))
+  return team.key() in UserTeams.forUser(user_id).teams
 
 
 def makeUserAdmin(user_id, team):
   AdminToTeam(user=user_id, team=team).put()
-  memcache.add(AdminToTeam.memcacheKey(user_id, team), True, 30)
+  teams = [team]
+  if (not migrationDone(USER_TEAMS_MIGRATION) and
+      UserTeams.get_by_key_name(user_id) is None):
+    # not indexed yet, so index the user's earlier teams too
+    teams = UserTeams.adminTeams(user_id) + teams
+  UserTeams.merge(user_id, teams)
+
+
+def removeUserAdmin(user_id, team):
+  db.delete(AdminToTeam.all(keys_only=True).filter("user =", user_id)
+            .filter("team =", team.key()))
+  UserTeams.discard(user_id, team.key())
 
 
 class TeamBaseHandler(BaseHandler):
   def validate(self, slug):
-    s = Slug.get_by_key_name(slug)
-    if s is None:
+    resolved = SLUG_CACHE.get(slug)
+    if resolved is None:
       self.notfound()
       return None, False, False
-    team = s.team
+    team_key, primary_slug = resolved
+    # GETs only render the team, so they can use the cached entity
+    if self.request.method == "GET":
+      team = getCachedTeam(team_key)
+    else:
+      team = Team.get(db.Key(team_key))
     if team is None:
       self.notfound()
       return None, False, False
+    if primary_slug != team.primary_slug:
+      # resolved before another instance gave the team a new primary slug
+      SLUG_CACHE.forget(slug)
     primary = True
     if team.primary_slug and team.primary_slug != slug:
       primary = False
     is_admin = False
-    if self.logged_in:
+    if not self.lazy_auth and self.logged_in:
       if isUserAdmin(self.current_user["user_id"], team):
         is_admin = True
     return team, primary, is_admin
@@ -405,16 +1388,19 @@ class TeamHandler(TeamBaseHandler):
       thank_url = None
     self.render_template(
         "show_team.html", team=team, edit_url=edit_url, thank_url=thank_url,
-        description_rendered=markdown.markdown(
-            jinja2.escape(team.description)))
+        description_rendered=team.descriptionHtml())
 
 class TeamHandler2(TeamBaseHandler):
+  lazy_auth = True
+
   def get(self, slug):
     team, primary, is_admin = self.validate(slug)
     if team is None:
       return
     if not primary:
       return self.redirect("/t/%s" % team.primary_slug, permanent=True)
+    if self.not_modified(slug, str(team.modification_time)):
+      return
     if is_admin:
       edit_url = "/t/%s/edit" % team.primary_slug
       thank_url = "/t/%s/thank" % team.primary_slug
@@ -423,37 +1409,71 @@ class TeamHandler2(TeamBaseHandler):
       thank_url = None
     self.render_template(
         "show_team2.html", team=team, edit_url=edit_url, thank_url=thank_url,
-        description_rendered=markdown.markdown(
-            jinja2.escape(team.description)))
+        auth_team=team.primary_slug,
+        description_rendered=team.descriptionHtml())
 
 class ShareTeamHandler(TeamBaseHandler):
+  lazy_auth = True
+
   def get(self, slug):
     team, primary, is_admin = self.validate(slug)
     if team is None:
       return
+    elif self.not_modified(slug, str(team.modification_time)):
+      return
     else:
       team_url = "https://my.mayday.us/t/" + team.primary_slug
       self.render_template(
           "share_team.html", team=team, team_url=team_url)
 
 
+class AuthStateHandler(BaseHandler):
+  """The login dependent parts of pages rendered with lazy_auth, for the
+  page in return_to and, if given, whether the user can edit a team.
+  """
+
+  @property
+  def return_to(self):
+    if config_NOCOMMIT.auth_service.requires_https:
+      self.request.scheme = "https"
+    home = self.request.host_url + "/"
+    return_to = self.request.get("return_to")
+    if not return_to.startswith(home):
+      return home
+    return return_to
+
+  def get(self):
+    state = {"logged_in": self.logged_in}
+    if self.logged_in:
+      state["logout_link"] = self.logout_link
+      slug = self.request.get("team")
+      resolved = slug and SLUG_CACHE.get(slug)
+      team = resolved and getCachedTeam(resolved[0])
+      if team and isUserAdmin(self.current_user["user_id"], team):
+        state["edit_url"] = "/t/%s/edit" % team.primary_slug
+        state["thank_url"] = "/t/%s/thank" % team.primary_slug
+    else:
+      state["login_links"] = self.login_links
+    self.response.headers["Content-Type"] = "application/json"
+    self.response.headers["Cache-Control"] = "private, no-cache"
+    self.response.write(json.dumps(state))
+
+
 class DashboardHandler(BaseHandler):
   @require_login
   def get(self):
-    teams = [a.team for a in
-             AdminToTeam.all().filter('user =',
-                self.current_user["user_id"])]
+    teams = UserTeams.forUser(self.current_user["user_id"]).memberships()
     self.render_template("dashboard.html", teams=teams)
 
 
 class NewTeamHandler(BaseHandler):
   @require_login
   def get(self):
-    self.render_template("new_team.html", form=TeamForm())
+    self.render_template("new_team.html", form=formsModule().TeamForm())
 
   @require_login
   def post(self):
-    form = TeamForm(self.request.POST)
+    form = formsModule().TeamForm(self.request.POST)
     if not form.validate():
       return self.render_template("new_team.html", form=form)
     team = Team.create(title=form.title.data,
@@ -464,14 +1484,10 @@ class NewTeamHandler(BaseHandler):
     # TODO: can i reference a team before putting it in other reference
     # properties? should check
     team.primary_slug = Slug.new(team)    
-    try:
-      result = config_NOCOMMIT.pledge_service.updateMailchimp(team) 
-    except Exception as e:
-      logging.error('Exception updating mailChimp: ' + str(e))
-      logging.info(traceback.format_exc())
-
     team.put()
+    teamSaved(team)
     makeUserAdmin(self.current_user["user_id"], team)
+    enqueueMailchimpUpdate(team)
     return self.redirect("/t/%s" % team.primary_slug)
 
 
@@ -495,8 +1511,8 @@ class NewFromPledgeHandler(FromPledgeBaseHandler):
         signature = "_Thank you,_\n\n_%s_" % user_info["name"]
       else:
         signature = "Thank you!"
-      title = user_info["name"] or DEFAULT_TITLE
-      form = TeamForm(data={
+      title = user_info["name"] or formsModule().DEFAULT_TITLE
+      form = formsModule().TeamForm(data={
           "goal_dollars": str(goal_dollars),
           "title": title,
           "zip_code": str(user_info["zip_code"] or ""),
@@ -506,7 +1522,7 @@ class NewFromPledgeHandler(FromPledgeBaseHandler):
               title=title)})
     else:
       self.add_to_user(team)
-      form = TeamForm(obj=team)
+      form = formsModule().TeamForm(obj=team)
     self.render_template("new_from_pledge.html", form=form)
 
   def post(self, user_token):
@@ -516,7 +1532,7 @@ class NewFromPledgeHandler(FromPledgeBaseHandler):
       user_info = config_NOCOMMIT.pledge_service.loadPledgeInfo(user_token)
       if user_info is None:
         return self.notfound()
-    form = TeamForm(self.request.POST, team)
+    form = formsModule().TeamForm(self.request.POST, team)
     if not form.validate():
       return self.render_template("new_from_pledge.html", form=form)
     if team is None:
@@ -532,12 +1548,10 @@ class NewFromPledgeHandler(FromPledgeBaseHandler):
       form.populate_obj(team)
     self.add_to_user(team)
     team.primary_slug = Slug.new(team)  
-    try:
-      result = config_NOCOMMIT.pledge_service.updateMailchimp(team) 
-    except Exception as e:
-      logging.error('Exception updating mailChimp: ' + str(e))
-      logging.info(traceback.format_exc())
+    team.renderDescription()
     team.put()
+    teamSaved(team)
+    enqueueMailchimpUpdate(team)
     if self.logged_in:
       return self.redirect("/t/%s" % team.primary_slug)
     return self.redirect("/dashboard/add_admin_from_pledge/%s" % user_token)
@@ -564,7 +1578,8 @@ class EditTeamHandler(TeamBaseHandler):
       return self.redirect("/t/%s/edit" % team.primary_slug, permanent=True)
     if not is_admin:
       return self.redirect("/t/%s" % team.primary_slug)
-    self.render_template("edit_team.html", form=TeamForm(obj=team))
+    self.render_template("edit_team.html",
+                         form=formsModule().TeamForm(obj=team))
 
   # require_login unneeded because we do the checking ourselves with validate
   def post(self, slug):
@@ -573,18 +1588,15 @@ class EditTeamHandler(TeamBaseHandler):
       return
     if not is_admin:
       return self.redirect("/t/%s" % team.primary_slug)
-    form = TeamForm(self.request.POST, team)
+    form = formsModule().TeamForm(self.request.POST, team)
     if not form.validate():
       return self.render_template("edit_team.html", form=form)
     form.populate_obj(team)
     team.primary_slug = Slug.new(team)
-    try:
-      result = config_NOCOMMIT.pledge_service.updateMailchimp(team) 
-    except Exception as e:
-      logging.error('Exception updating mailChimp: ' + str(e))
-      logging.info(traceback.format_exc())
-  
+    team.renderDescription()
     team.put()
+    teamSaved(team)
+    enqueueMailchimpUpdate(team)
     self.redirect("/t/%s" % team.primary_slug)
 
 
@@ -598,7 +1610,8 @@ class ThankTeamHandler(TeamBaseHandler):
       return self.redirect("/t/%s/edit" % team.primary_slug, permanent=True)
     if not is_admin:
       return self.redirect("/t/%s" % team.primary_slug)
-    self.render_template("thank_team.html", form=ThankYouForm(obj=team))
+    self.render_template("thank_team.html",
+                         form=formsModule().ThankYouForm(obj=team))
 
   # require_login unneeded because we do the checking ourselves with validate
   def post(self, slug):
@@ -607,34 +1620,61 @@ class ThankTeamHandler(TeamBaseHandler):
       return
     if not is_admin:
       return self.redirect("/t/%s" % team.primary_slug)
-    form = ThankYouForm(self.request.POST)
+    form = formsModule().ThankYouForm(self.request.POST)
     if not form.validate():
       return self.render_template("thank_team.html", form=form)
 
-    data = form.data.copy()
-    data["team"] = team.key()
+    job = ThankJob(team=team, **form.data)
+    job.put()
+    try:
+      enqueueThankBatch(job, 0)
+    except Exception as e:
+      # the status page shows the job failed rather than running forever
+      logging.error('Exception enqueueing thank you job: ' + str(e))
+      ThankJob.failed(job.key(), "The message could not be queued, please "
+                      "try again.")
+    return self.redirect("/t/%s/thank/%d" % (
+        team.primary_slug, job.key().id()))
 
-    payload = urllib.urlencode(data)
 
-    url = self.pledge_root_url + "/r/thank"
+class ThankStatusHandler(TeamBaseHandler):
+  # require_login unneeded because we do the checking ourselves with validate
+  def get(self, slug, job_id):
+    team, _, is_admin = self.validate(slug)
+    if team is None:
+      return
+    if not is_admin:
+      return self.redirect("/t/%s" % team.primary_slug)
+    job = ThankJob.get_by_id(int(job_id))
+    if job is None or ThankJob.team.get_value_for_datastore(job) != team.key():
+      return self.notfound()
+    self.render(team, job)
 
-    result = urlfetch.fetch(url=url,
-      payload=payload,
-      method=urlfetch.POST,
-      validate_certificate=False)
+  def render(self, team, job):
+    self.render_template("thank_team_success.html",
+      progress=job.progress(),
+      progress_url="/t/%s/thank/%d.json" % (
+          team.primary_slug, job.key().id()),
+      team_url="/t/%s" % team.primary_slug)
 
 
-    if result.status_code == 200:
-      response_data = json.loads(result.content)
-      num_emailed = response_data["num_emailed"]
-      total_pledges = response_data["total_pledges"]
+class ThankProgressHandler(ThankStatusHandler):
+  def render(self, team, job):
+    self.response.headers["Content-Type"] = "application/json"
+    self.response.headers["Cache-Control"] = "private, no-cache"
+    self.response.write(json.dumps(job.progress()))
 
-      return self.render_template("thank_team_success.html",
-        num_emailed=num_emailed,
-        total_pledges=total_pledges,
-        team_url="/t/%s" % team.primary_slug)
-    else:
-      return self.render_template("thank_team.html", form=form, error=result.content)
+
+def enqueueThankBatch(job, offset):
+  """Starts the batch of job's pledges at offset. The task name makes
+  enqueueing a batch again a no-op.
+  """
+  try:
+    taskqueue.add(queue_name="thank", url="/tasks/thank",
+                  name="thank-%d-%d" % (job.key().id(), offset),
+                  params={"job": job.key().id(), "offset": offset})
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
 
 
 class AdminHandler(webapp2.RequestHandler):
@@ -652,15 +1692,401 @@ class SiteAdminCSV(AdminHandler):
     self.render_template("site_csv.html")
 
 
+class SiteAdminTeamsCSV(AdminHandler):
+  """Writes the teams, with their pledge totals and creator info, as CSV.
+  A response covers at most MAX_TEAMS teams or TIME_BUDGET seconds; if there
+  are more, the X-Next-Cursor header gives the cursor to continue from.
+  """
+  BATCH_SIZE = 50
+  MAX_TEAMS = 2000
+  TIME_BUDGET = 30
+  COLUMNS = ["key", "title", "slug", "url", "zip_code", "user_token",
+             "crtime", "mtime", "version", "pledges", "dollars",
+             "user_token_name", "user_token_email"]
+
+  def rows(self, teams):
+    pledge_service = config_NOCOMMIT.pledge_service
+    totals = pledge_service.getTeamTotals(teams)
+    tokens = [team.user_token for team in teams if team.user_token]
+    user_infos = dict(zip(tokens, pledge_service.loadPledgeInfos(tokens)))
+    for team, total in zip(teams, totals):
+      pledges, dollars = "", ""
+      if total is not None:
+        dollars, pledges = total[0] / 100.0, total[1]
+      name, email = "", ""
+      user_info = user_infos.get(team.user_token)
+      if user_info:
+        name, email = user_info["name"], user_info["email"]
+      yield [str(team.key()), team.title, team.primary_slug,
+             "%s/t/%s" % (self.request.application_url, team.primary_slug),
+             team.zip_code, team.user_token, str(team.creation_time),
+             str(team.modification_time), team.team_version, pledges,
+             dollars, name, email]
+
+  def get(self):
+    self.response.headers["Content-Type"] = "text/csv; charset=utf-8"
+    self.response.headers["Content-Disposition"] = \
+        "attachment; filename=teams.csv"
+    writer = csv.writer(self.response.out)
+    cursor = self.request.get("cursor")
+    if not cursor:
+      writer.writerow(self.COLUMNS)
+    deadline = time.time() + self.TIME_BUDGET
+    written = 0
+    while written < self.MAX_TEAMS and time.time() < deadline:
+      query = teamExportQuery()
+      if cursor:
+        query.with_cursor(cursor)
+      teams = query.fetch(self.BATCH_SIZE)
+      for row in self.rows(teams):
+        writer.writerow([
+            unicode(value).encode("utf-8") if value is not None else ""
+            for value in row])
+      written += len(teams)
+      if len(teams) < self.BATCH_SIZE:
+        return
+      cursor = query.cursor()
+    self.response.headers["X-Next-Cursor"] = cursor
+
+
+class SiteAdminStats(AdminHandler):
+  def get(self):
+    self.response.headers["Content-Type"] = "application/json"
+    self.response.write(json.dumps({
+        "description_cache": DESCRIPTION_CACHE.stats,
+        "leaderboard_cache": LEADERBOARD_CACHE.stats,
+        "leaderboard_index": LEADERBOARD_INDEX.stats,
+        "slug_cache": SLUG_CACHE.stats,
+        "auth_cache": getattr(config_NOCOMMIT.auth_service, "stats", None),
+        "pledge_breaker": getattr(getattr(
+            config_NOCOMMIT.pledge_service, "breaker", None), "stats", None),
+        "http": httpclient.SHARED.stats}))
+
+
+class LeaderboardRefreshTask(webapp2.RequestHandler):
+  # cron
+  def get(self):
+    if useLocalLeaderboard():
+      return
+    for block, orderBy in LEADERBOARD_WARM_VIEWS:
+      LEADERBOARD_CACHE.refresh(block, orderBy)
+
+  # enqueued by LeaderboardCache for a stale snapshot
+  def post(self):
+    if not self.request.get("block"):
+      # queued before snapshots were kept per block
+      return
+    LEADERBOARD_CACHE.refresh(int(self.request.get("block")),
+                              self.request.get("orderBy"))
+
+
+class LeaderboardSnapshotTask(webapp2.RequestHandler):
+  """Saves this instance's LEADERBOARD_INDEX as the snapshot new instances
+  load, building it from a full scan when there is none. ?rebuild=1 from
+  site admin queues a full rebuild.
+  """
+
+  # cron
+  def get(self):
+    if self.request.get("rebuild"):
+      taskqueue.add(url="/tasks/leaderboard/snapshot")
+      self.response.write("rebuild queued")
+      return
+    if not useLocalLeaderboard():
+      self.response.write("local_leaderboard is off")
+      return
+    LEADERBOARD_INDEX.refreshSnapshot()
+    self.response.write("saved %d teams" % LEADERBOARD_INDEX.stats["teams"])
+
+  # enqueued by get for ?rebuild=1, since a full scan can outlast a request
+  def post(self):
+    LEADERBOARD_INDEX.rebuild()
+
+
+class MigrateUserTeamsTask(webapp2.RequestHandler):
+  """Builds the UserTeams index from existing AdminToTeam rows, a batch per
+  task, following the query cursor, then marks USER_TEAMS_MIGRATION done.
+  """
+  BATCH_SIZE = 100
+
+  def get(self):
+    taskqueue.add(url="/tasks/migrate/user_teams")
+    self.response.write("started")
+
+  def post(self):
+    query = AdminToTeam.all()
+    cursor = self.request.get("cursor")
+    if cursor:
+      query.with_cursor(cursor)
+    admins = query.fetch(self.BATCH_SIZE)
+    team_keys = [AdminToTeam.team.get_value_for_datastore(a) for a in admins]
+    teams = dict((str(team.key()), team) for team in Team.get(team_keys)
+                 if team is not None)
+    by_user = collections.defaultdict(list)
+    for admin, key in zip(admins, team_keys):
+      if str(key) in teams:
+        by_user[admin.user].append(teams[str(key)])
+    for user_id, user_teams in by_user.iteritems():
+      UserTeams.merge(user_id, user_teams)
+    if len(admins) == self.BATCH_SIZE:
+      taskqueue.add(url="/tasks/migrate/user_teams",
+                    params={"cursor": query.cursor()})
+    else:
+      MigrationDone(key_name=USER_TEAMS_MIGRATION).put()
+
+
+class MigrateDescriptionHtmlTask(webapp2.RequestHandler):
+  """Upgrades teams older than Team.CURRENT_VERSION, rendering their
+  description_html, a batch per task.
+  """
+  BATCH_SIZE = 50
+
+  def get(self):
+    taskqueue.add(url="/tasks/migrate/description_html")
+    self.response.write("started")
+
+  def post(self):
+    query = Team.all(keys_only=True).filter(
+        "team_version <", Team.CURRENT_VERSION)
+    cursor = self.request.get("cursor")
+    if cursor:
+      query.with_cursor(cursor)
+    team_keys = query.fetch(self.BATCH_SIZE)
+    for team_key in team_keys:
+      Team.upgrade(team_key)
+    if len(team_keys) == self.BATCH_SIZE:
+      taskqueue.add(url="/tasks/migrate/description_html",
+                    params={"cursor": query.cursor()})
+
+
+class MigrateTeamExportFieldsTask(webapp2.RequestHandler):
+  """Gives every Team all of TEAM_EXPORT_FIELDS, so site admin exports can
+  use a projection query, then marks TEAM_EXPORT_MIGRATION done. Scans all
+  team keys a batch per task. Missing fields get their property's default,
+  written without the model so modification_time stays as it was.
+  """
+  BATCH_SIZE = 100
+
+  def get(self):
+    taskqueue.add(url="/tasks/migrate/export_fields")
+    self.response.write("started")
+
+  @staticmethod
+  def fill(entity):
+    """Sets the missing export fields of a raw Team entity. Returns whether
+    any were missing.
+    """
+    missing = [name for name in TEAM_EXPORT_FIELDS if name not in entity]
+    for name in missing:
+      entity[name] = Team.properties()[name].default
+    return bool(missing)
+
+  def post(self):
+    def txn(key):
+      entity = datastore.Get(key)
+      if self.fill(entity):
+        datastore.Put(entity)
+
+    query = Team.all(keys_only=True)
+    cursor = self.request.get("cursor")
+    if cursor:
+      query.with_cursor(cursor)
+    team_keys = query.fetch(self.BATCH_SIZE)
+    for entity in datastore.Get(team_keys):
+      if entity is not None and self.fill(entity):
+        db.run_in_transaction(txn, entity.key())
+    if len(team_keys) == self.BATCH_SIZE:
+      taskqueue.add(url="/tasks/migrate/export_fields",
+                    params={"cursor": query.cursor()})
+    else:
+      MigrationDone(key_name=TEAM_EXPORT_MIGRATION).put()
+
+
+class CompactTeamTotalsTask(webapp2.RequestHandler):
+  """Compacts every team that has TeamTotalsShards, a batch per task."""
+  BATCH_SIZE = 200
+
+  # cron
+  def get(self):
+    self.post()
+
+  def post(self):
+    query = TeamTotalsShard.all(keys_only=True)
+    cursor = self.request.get("cursor")
+    if cursor:
+      query.with_cursor(cursor)
+    shard_keys = query.fetch(self.BATCH_SIZE)
+    for team_key in set(key.name().rsplit(":", 1)[0] for key in shard_keys):
+      compactTeamTotals(team_key)
+    if len(shard_keys) == self.BATCH_SIZE:
+      taskqueue.add(url="/tasks/counters/compact",
+                    params={"cursor": query.cursor()})
+
+
+class PledgeWebhookHandler(webapp2.RequestHandler):
+  """Called by the pledge service for every pledge, with the team key,
+  pledge_id, amount_cents, optionally pledges (-1 for a refund) and the
+  shared secret from config_NOCOMMIT.PLEDGE_WEBHOOK_SECRET.
+  """
+
+  def post(self):
+    secret = getattr(config_NOCOMMIT, "PLEDGE_WEBHOOK_SECRET", None)
+    if not secret or not hmac.compare_digest(
+        str(secret), self.request.get("secret").encode("utf-8")):
+      self.response.status = 403
+      return
+    try:
+      team_key = str(db.Key(self.request.get("team")))
+      pledge_id = self.request.get("pledge_id")
+      cents = int(self.request.get("amount_cents"))
+      pledges = int(self.request.get("pledges", "1"))
+    except (db.BadKeyError, ValueError):
+      self.response.status = 400
+      return
+    if not pledge_id:
+      self.response.status = 400
+      return
+    counted = addPledge(team_key, pledge_id, cents, pledges)
+    self.response.headers["Content-Type"] = "application/json"
+    self.response.write(json.dumps({"counted": counted}))
+
+
+class MailchimpUpdateTask(webapp2.RequestHandler):
+  # enqueued by MAILCHIMP_QUEUE after a team is saved
+  def post(self):
+    updateMailchimp(self.request.get("team"))
+
+
+class ThankTask(webapp2.RequestHandler):
+  # enqueued by enqueueThankBatch, a batch of a ThankJob
+  def post(self):
+    job = ThankJob.get_by_id(int(self.request.get("job")))
+    offset = int(self.request.get("offset"))
+    if job is None or job.status != "running":
+      return
+    pledge_service = config_NOCOMMIT.pledge_service
+    batch_size = getattr(pledge_service, "THANK_BATCH_SIZE", None)
+    if offset not in job.done_offsets:
+      batch = ThankBatch.claim(job.key().id(), offset)
+      if batch is None:
+        team_key = str(ThankJob.team.get_value_for_datastore(job))
+        try:
+          result = pledge_service.thankTeam(
+              team_key, job.formData(), offset=batch_size and offset,
+              limit=batch_size)
+        except Exception as e:
+          # not retried, a retry could email the batch twice
+          logging.exception("thank you batch %d of job %d failed",
+                            offset, job.key().id())
+          ThankJob.failed(job.key(), str(e))
+          return
+        batch = ThankBatch(
+            key_name=ThankBatch.keyName(job.key().id(), offset), sent=True,
+            num_emailed=result["num_emailed"],
+            total_pledges=result["total_pledges"])
+        batch.put()
+      elif not batch.sent:
+        # an earlier attempt died between claiming and recording the batch,
+        # it may or may not have emailed it
+        ThankJob.failed(job.key(), "batch %d may not have been sent" % offset)
+        return
+      # a failure here is retried with the recorded result
+      job = ThankJob.batchDone(job.key(), offset, batch.result(), batch_size)
+    # the first batch starts the rest. a retry of it starts the ones that
+    # were not enqueued.
+    if offset == 0:
+      for pending in job.pendingOffsets(batch_size):
+        enqueueThankBatch(job, pending)
+
+
+class WarmupHandler(webapp2.RequestHandler):
+  # /_ah/warmup, sent to new instances before they get traffic
+  def get(self):
+    for name in templating.templateNames():
+      JINJA.get_template(name)
+
+
+class MigrationDone(db.Model):
+  """Marks a finished migration, by key name."""
+  done_time = db.DateTimeProperty(auto_now_add=True)
+
+
+# named after the fields, so exporting another field means filling it first
+TEAM_EXPORT_MIGRATION = "team_export_fields:" + ",".join(TEAM_EXPORT_FIELDS)
+USER_TEAMS_MIGRATION = "user_teams"
+# migrations seen done by this instance. once done, they stay so.
+_migrations_done = set()
+
+
+def migrationDone(name):
+  """Whether the migration called name has finished."""
+  if name not in _migrations_done:
+    if MigrationDone.get_by_key_name(name) is None:
+      return False
+    _migrations_done.add(name)
+  return True
+
+
+def teamExportFieldsFilled():
+  """Whether every Team has all of TEAM_EXPORT_FIELDS, see
+  MigrateTeamExportFieldsTask.
+  """
+  return migrationDone(TEAM_EXPORT_MIGRATION)
+
+
+def teamExportQuery():
+  """The query for the Teams the site admin exports. Once every team has
+  all of TEAM_EXPORT_FIELDS it is a projection query, which leaves the
+  image and description out of the fetch and needs the Team index in
+  index.yaml. Until then it loads whole teams, since a projection query
+  skips entities missing a projected property.
+  """
+  if teamExportFieldsFilled():
+    return db.Query(Team, projection=TEAM_EXPORT_FIELDS)
+  return Team.all()
+
+
 class SiteAdminTeams(AdminHandler):
+  """Writes ?amount= teams (at most MAX_AMOUNT) as a JSON object with
+  their fields, the next_cursor to continue from and count_estimate, the
+  number of teams. Teams are written as they are fetched.
+  """
+  BATCH_SIZE = 100
+  MAX_AMOUNT = 1000
+  # counted with a keys only query when there are no datastore statistics
+  # yet, up to this many, and kept in memcache for COUNT_TTL
+  COUNT_LIMIT = 10000
+  COUNT_TTL = 10 * 60
+
+  def countEstimate(self):
+    from google.appengine.ext.db import stats
+    kind_stat = stats.KindStat.all().filter("kind_name =", "Team").get()
+    if kind_stat is not None:
+      return kind_stat.count
+    count = memcache.get("team_count_estimate")
+    if count is None:
+      count = Team.all(keys_only=True).count(self.COUNT_LIMIT)
+      memcache.set("team_count_estimate", count, self.COUNT_TTL)
+    return count
+
   def get(self):
-    query = Team.all()
+    try:
+      amount = int(self.request.get("amount", 100))
+    except ValueError:
+      amount = 100
+    amount = min(max(amount, 1), self.MAX_AMOUNT)
+    query = teamExportQuery()
     cursor = self.request.get("cursor")
     if cursor:
       query.with_cursor(cursor)
-    teams = []
-    for team in query.fetch(int(self.request.get("amount", 100))):
-      teams.append({
+    self.response.headers["Content-Type"] = "application/json"
+    out = self.response.out
+    out.write('{"teams": [')
+    for i, team in enumerate(query.run(limit=amount,
+                                       batch_size=self.BATCH_SIZE)):
+      if i:
+        out.write(", ")
+      out.write(json.dumps({
           "key": str(team.key()),
           "title": team.title,
           "slug": team.primary_slug,
@@ -669,11 +2095,9 @@ class SiteAdminTeams(AdminHandler):
           "user_token": team.user_token,
           "crtime": str(team.creation_time),
           "mtime": str(team.modification_time),
-          "version": team.team_version})
-    cursor = query.cursor()
-    self.response.write(json.dumps({
-        "next_cursor": cursor,
-        "teams": teams}))
+          "version": team.team_version}))
+    out.write('], "next_cursor": %s, "count_estimate": %s}' % (
+        json.dumps(query.cursor()), json.dumps(self.countEstimate())))
 
 
 app = webapp2.WSGIApplication(config_NOCOMMIT.auth_service.handlers() + [
@@ -682,7 +2106,10 @@ app = webapp2.WSGIApplication(config_NOCOMMIT.auth_service.handlers() + [
   (r'/t/([^/]+)/edit?', EditTeamHandler),
   (r'/t/([^/]+)/share?', ShareTeamHandler),
   (r'/t/([^/]+)/thank?', ThankTeamHandler),
+  (r'/t/([^/]+)/thank/(\d+)\.json', ThankProgressHandler),
+  (r'/t/([^/]+)/thank/(\d+)/?', ThankStatusHandler),
   (r'/login/?', LoginHandler),
+  (r'/auth/state.json', AuthStateHandler),
   (r'/dashboard/?', DashboardHandler),
   (r'/dashboard/new/?', NewTeamHandler),
   (r'/dashboard/new_from_pledge/(\w+)', NewFromPledgeHandler),
@@ -690,6 +2117,18 @@ app = webapp2.WSGIApplication(config_NOCOMMIT.auth_service.handlers() + [
   (r'/site-admin/?', SiteAdminIndex),
   (r'/site-admin/csv/?', SiteAdminCSV),
   (r'/site-admin/teams.json', SiteAdminTeams),
+  (r'/site-admin/teams.csv', SiteAdminTeamsCSV),
+  (r'/site-admin/stats.json', SiteAdminStats),
+  (r'/tasks/leaderboard/refresh', LeaderboardRefreshTask),
+  (r'/tasks/migrate/user_teams', MigrateUserTeamsTask),
+  (r'/tasks/migrate/description_html', MigrateDescriptionHtmlTask),
+  (r'/tasks/migrate/export_fields', MigrateTeamExportFieldsTask),
+  (pledge.MAILCHIMP_TASK_URL, MailchimpUpdateTask),
+  (r'/tasks/thank', ThankTask),
+  (r'/_ah/warmup', WarmupHandler),
+  (r'/tasks/counters/compact', CompactTeamTotalsTask),
+  (r'/tasks/leaderboard/snapshot', LeaderboardSnapshotTask),
+  (r'/hooks/pledge', PledgeWebhookHandler),
   (r'/?', IndexHandler),
   (r'/leaderboard/?', LeaderboardHandler),
   (r'.*', NotFoundHandler)], debug=False)
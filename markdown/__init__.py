@@ -36,6 +36,7 @@ from .__version__ import version, version_info
 import codecs
 import sys
 import logging
+import threading
 from . import util
 from .preprocessors import build_preprocessors
 from .blockprocessors import build_block_parser
@@ -44,8 +45,10 @@ from .inlinepatterns import build_inlinepatterns
 from .postprocessors import build_postprocessors
 from .extensions import Extension
 from .serializers import to_html_string, to_xhtml_string
+from .serializers import write_html, write_xhtml
 
-__all__ = ['Markdown', 'markdown', 'markdownFromFile']
+__all__ = ['Markdown', 'MarkdownPool', 'markdown', 'markdownToStream',
+           'markdownFromFile']
 
 logger = logging.getLogger('MARKDOWN')
 
@@ -61,6 +64,7 @@ class Markdown(object):
         'enable_attributes'     : True,
         'smart_emphasis'        : True,
         'lazy_ol'               : True,
+        'inline_engine'         : 'classic',
     }
 
     output_formats = {
@@ -72,6 +76,16 @@ class Markdown(object):
         'xhtml5': to_xhtml_string,
     }
 
+    # Serializers writing fragments to a callable, used by convertToStream.
+    stream_formats = {
+        'html'  : write_html,
+        'html4' : write_html,
+        'html5' : write_html,
+        'xhtml' : write_xhtml,
+        'xhtml1': write_xhtml,
+        'xhtml5': write_xhtml,
+    }
+
     ESCAPED_CHARS = ['\\', '`', '*', '_', '{', '}', '[', ']',
                     '(', ')', '>', '#', '+', '-', '.', '!']
 
@@ -102,6 +116,9 @@ class Markdown(object):
         * enable_attributes: Enable the conversion of attributes. Default: True
         * smart_emphasis: Treat `_connected_words_` intelligently Default: True
         * lazy_ol: Ignore number of first item of ordered lists. Default: True
+        * inline_engine: How inline patterns are applied. One of "classic" or
+            "scanner". Both produce the same tree; "scanner" skips patterns
+            which cannot match and avoids anchored regexes. Default: "classic"
 
         """
 
@@ -249,31 +266,16 @@ class Markdown(object):
             raise
         return self
 
-    def convert(self, source):
+    def buildTree(self, source):
         """
-        Convert markdown to serialized XHTML or HTML.
-
-        Keyword arguments:
+        Run the preprocessors, the BlockParser and the treeprocessors over
+        source (steps 1 to 3 of `convert`).
 
-        * source: Source text as a Unicode string.
-
-        Markdown processing takes place in five steps:
-
-        1. A bunch of "preprocessors" munge the input text.
-        2. BlockParser() parses the high-level structural elements of the
-           pre-processed text into an ElementTree.
-        3. A bunch of "treeprocessors" are run against the ElementTree. One
-           such treeprocessor runs InlinePatterns against the ElementTree,
-           detecting inline markup.
-        4. Some post-processors are run against the text after the ElementTree
-           has been serialized into text.
-        5. The output is written to a string.
+        Returns: The root ElementTree element, or None for a blank document.
 
         """
-
-        # Fixup the source text
         if not source.strip():
-            return ''  # a blank unicode string
+            return None
 
         try:
             source = util.text_type(source)
@@ -295,6 +297,33 @@ class Markdown(object):
             newRoot = treeprocessor.run(root)
             if newRoot is not None:
                 root = newRoot
+        return root
+
+    def convert(self, source):
+        """
+        Convert markdown to serialized XHTML or HTML.
+
+        Keyword arguments:
+
+        * source: Source text as a Unicode string.
+
+        Markdown processing takes place in five steps:
+
+        1. A bunch of "preprocessors" munge the input text.
+        2. BlockParser() parses the high-level structural elements of the
+           pre-processed text into an ElementTree.
+        3. A bunch of "treeprocessors" are run against the ElementTree. One
+           such treeprocessor runs InlinePatterns against the ElementTree,
+           detecting inline markup.
+        4. Some post-processors are run against the text after the ElementTree
+           has been serialized into text.
+        5. The output is written to a string.
+
+        """
+
+        root = self.buildTree(source)
+        if root is None:
+            return ''  # a blank unicode string
 
         # Serialize _properly_.  Strip top-level tags.
         output = self.serializer(root)
@@ -317,6 +346,60 @@ class Markdown(object):
 
         return output.strip()
 
+    def convertToStream(self, source, output):
+        """
+        Convert markdown and write the XHTML or HTML to a stream as it is
+        serialized, giving the same text as `convert`.
+
+        The top-level tags are left out while serializing rather than
+        searched for and cut from the output afterwards, and postprocessors
+        are run on each fragment as it is written. If a postprocessor is not
+        `streamable`, or the output format has no stream serializer, the
+        document is converted with `convert` and written at once.
+
+        Keyword arguments:
+
+        * source: Source text as a Unicode string.
+        * output: Any object with a `write` method taking Unicode strings,
+          such as a file opened through `codecs` or a webapp2 `response.out`.
+
+        """
+        postprocessors = list(self.postprocessors.values())
+        serializer = self.stream_formats.get(self.output_format)
+        if serializer is None or \
+                not all(pp.streamable for pp in postprocessors):
+            output.write(self.convert(source))
+            return self
+
+        root = self.buildTree(source)
+        if root is None:
+            return self
+        for pp in postprocessors:
+            pp.prepareTree(root)
+
+        # Strip the document like `convert` does: drop leading whitespace
+        # and hold whitespace back until more text follows it.
+        pending = []
+        state = {'started': False}
+        def write(fragment):
+            for pp in postprocessors:
+                fragment = pp.run(fragment)
+            if not state['started']:
+                fragment = fragment.lstrip()
+                if not fragment:
+                    return
+                state['started'] = True
+            text = fragment.rstrip()
+            if text:
+                if pending:
+                    output.write(''.join(pending))
+                    del pending[:]
+                output.write(text)
+            pending.append(fragment[len(text):])
+
+        serializer(write, root, skip_root=self.stripTopLevelTags)
+        return self
+
     def convertFile(self, input=None, output=None, encoding=None):
         """Converts a markdown file and returns the HTML as a unicode string.
 
@@ -384,6 +467,123 @@ class Markdown(object):
         return self
 
 
+class MarkdownPool(object):
+    """
+    A thread-safe pool of pre-built Markdown instances which share one
+    configuration.
+
+    Building a Markdown instance compiles every processor and inline pattern,
+    which usually costs more than converting a short document. A pool hands
+    out instances that have already been built and resets them once they are
+    returned, so that each document starts with a clean state.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Creates a new, empty pool.
+
+        Keyword arguments:
+
+        * max_size: Maximum number of idle instances kept. Default: 8
+        * Any arguments accepted by the Markdown class.
+
+        """
+        self.max_size = kwargs.pop('max_size', 8)
+        self.args = args
+        self.kwargs = kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Return an idle Markdown instance, building one if needed. """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Markdown(*self.args, **self.kwargs)
+
+    def release(self, md):
+        """ Reset a Markdown instance and return it to the pool. """
+        md.reset()
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(md)
+
+    def convert(self, source):
+        """ Convert source with a pooled instance. See Markdown.convert. """
+        md = self.acquire()
+        try:
+            return md.convert(source)
+        finally:
+            self.release(md)
+
+    def convertToStream(self, source, output):
+        """ Stream source with a pooled instance. See convertToStream. """
+        md = self.acquire()
+        try:
+            md.convertToStream(source, output)
+        finally:
+            self.release(md)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Extensions whose state is cleared by Markdown.reset(), so that instances
+# using them can be shared between documents. Others, such as abbr (and
+# extra, which loads it), add inline patterns for each document they convert
+# and are never pooled.
+POOLABLE_EXTENSIONS = frozenset([
+    'admonition', 'attr_list', 'codehilite', 'def_list', 'fenced_code',
+    'footnotes', 'headerid', 'meta', 'nl2br', 'sane_lists', 'smart_strong',
+    'smarty', 'tables', 'toc', 'wikilinks',
+])
+
+
+def _poolable_extension(ext):
+    """ Return True if the named extension resets cleanly. """
+    if not isinstance(ext, util.string_type):
+        # extension objects hold per-instance state
+        return False
+    name = ext.split('(', 1)[0]
+    if name.startswith('markdown.extensions.'):
+        name = name[len('markdown.extensions.'):]
+    return name in POOLABLE_EXTENSIONS
+
+
+def _freeze(value):
+    """ Return a hashable version of a list or dict of Markdown options. """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def get_pool(*args, **kwargs):
+    """
+    Return the shared MarkdownPool for the given Markdown arguments.
+
+    Returns None when the arguments cannot safely be shared between
+    instances, i.e. when they are unhashable or when an extension is not
+    one of POOLABLE_EXTENSIONS given by name.
+
+    """
+    extensions = kwargs.get('extensions', args[0] if args else None) or []
+    if not all(_poolable_extension(ext) for ext in extensions):
+        return None
+    key = (_freeze(args), _freeze(kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = MarkdownPool(*args, **kwargs)
+    return pool
+
+
 """
 EXPORTED FUNCTIONS
 =============================================================================
@@ -396,8 +596,9 @@ def markdown(text, *args, **kwargs):
     """Convert a markdown string to HTML and return HTML as a unicode string.
 
     This is a shortcut function for `Markdown` class to cover the most
-    basic use case.  It initializes an instance of Markdown, loads the
-    necessary extensions and runs the parser on the given text.
+    basic use case.  It takes an instance of Markdown from the pool for the
+    given arguments (see `get_pool`), loads the necessary extensions and runs
+    the parser on the given text.
 
     Keyword arguments:
 
@@ -407,8 +608,30 @@ def markdown(text, *args, **kwargs):
     Returns: An HTML document as a string.
 
     """
-    md = Markdown(*args, **kwargs)
-    return md.convert(text)
+    pool = get_pool(*args, **kwargs)
+    if pool is None:
+        return Markdown(*args, **kwargs).convert(text)
+    return pool.convert(text)
+
+
+def markdownToStream(text, output, *args, **kwargs):
+    """Convert a markdown string to HTML and write it to a stream.
+
+    This is a shortcut function which takes an instance of Markdown from the
+    pool for the given arguments and calls its convertToStream method.
+
+    Keyword arguments:
+
+    * text: Markdown formatted text as Unicode or ASCII string.
+    * output: An object with a `write` method taking Unicode strings.
+    * Any arguments accepted by the Markdown class.
+
+    """
+    pool = get_pool(*args, **kwargs)
+    if pool is None:
+        Markdown(*args, **kwargs).convertToStream(text, output)
+    else:
+        pool.convertToStream(text, output)
 
 
 def markdownFromFile(*args, **kwargs):
@@ -302,6 +302,9 @@ class FootnoteTreeprocessor(Treeprocessor):
 
 class FootnotePostprocessor(Postprocessor):
     """ Replace placeholders with html entities. """
+
+    streamable = True
+
     def __init__(self, footnotes):
         self.footnotes = footnotes
 
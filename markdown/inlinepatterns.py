@@ -120,6 +120,29 @@ HTML_RE = r'(\<([a-zA-Z/][^\>]*?|\!--.*?--)\>)'               # <...>
 ENTITY_RE = r'(&[\#a-zA-Z0-9]*;)'               # &amp;
 LINE_BREAK_RE = r'  \n'                     # two spaces at end of line
 
+# The characters a match of each built-in pattern can start with. Used by the
+# "scanner" inline engine to skip patterns which cannot match a string.
+TRIGGER_CHARS = {
+    BACKTICK_RE: '`',
+    ESCAPE_RE: '\\',
+    EMPHASIS_RE: '*',
+    STRONG_RE: '*_',
+    STRONG_EM_RE: '*_',
+    SMART_EMPHASIS_RE: '_',
+    EMPHASIS_2_RE: '_',
+    LINK_RE: '[',
+    IMAGE_LINK_RE: '!',
+    REFERENCE_RE: '[',
+    SHORT_REF_RE: '[',
+    IMAGE_REFERENCE_RE: '!',
+    NOT_STRONG_RE: ' *_',
+    AUTOLINK_RE: '<',
+    AUTOMAIL_RE: '<',
+    HTML_RE: '<',
+    ENTITY_RE: '&',
+    LINE_BREAK_RE: ' ',
+}
+
 
 def dequote(string):
     """Remove quotes from around a string."""
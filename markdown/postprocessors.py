@@ -12,6 +12,7 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from . import util
 from . import odict
+import heapq
 import re
 
 
@@ -33,8 +34,24 @@ class Postprocessor(util.Processor):
 
     Postprocessors must extend markdown.Postprocessor.
 
+    Postprocessors whose `run` gives the same result when called on each
+    fragment of the serialized document as when called on the whole of it
+    should set `streamable` to True, so that Markdown.convertToStream can
+    apply them as the document is written.
+
     """
 
+    streamable = False
+
+    def prepareTree(self, root):
+        """
+        Called by Markdown.convertToStream with the root ElementTree before
+        it is serialized, for streamable postprocessors which would otherwise
+        need to match text spanning several fragments.
+
+        """
+        pass
+
     def run(self, text):
         """
         Subclasses of Postprocessor should implement a `run` method, which
@@ -48,17 +65,59 @@ class Postprocessor(util.Processor):
 class RawHtmlPostprocessor(Postprocessor):
     """ Restore raw html to the document. """
 
+    streamable = True
+
+    def stashedHtml(self, i):
+        """ Return the html to restore for stash entry i and if it is safe. """
+        html, safe  = self.markdown.htmlStash.rawHtmlBlocks[i]
+        if self.markdown.safeMode and not safe:
+            if str(self.markdown.safeMode).lower() == 'escape':
+                html = self.escape(html)
+            elif str(self.markdown.safeMode).lower() == 'remove':
+                html = ''
+            else:
+                html = self.markdown.html_replacement_text
+        return html, safe
+
+    def prepareTree(self, root):
+        """
+        Unwrap the paragraphs `run` would replace with block level html.
+
+        Such a paragraph is left without a tag and its placeholder followed
+        by the newline `run` adds, so that the text placeholder substitution
+        done on each fragment gives the same result.
+
+        """
+        placeholders = set()
+        for i in range(self.markdown.htmlStash.html_counter):
+            html, safe = self.stashedHtml(i)
+            if self.isblocklevel(html) and (safe or not self.markdown.safeMode):
+                placeholders.add(self.markdown.htmlStash.get_placeholder(i))
+        if not placeholders:
+            return
+        for p in root.getiterator('p'):
+            if p.text in placeholders and not len(p) and not p.attrib:
+                p.tag = None
+                p.text += "\n"
+
     def run(self, text):
         """ Iterate over html stash and restore "safe" html. """
-        for i in range(self.markdown.htmlStash.html_counter):
-            html, safe  = self.markdown.htmlStash.rawHtmlBlocks[i]
-            if self.markdown.safeMode and not safe:
-                if str(self.markdown.safeMode).lower() == 'escape':
-                    html = self.escape(html)
-                elif str(self.markdown.safeMode).lower() == 'remove':
-                    html = ''
-                else:
-                    html = self.markdown.html_replacement_text
+        if util.STX not in text:
+            return text
+        # Visit only the stash entries whose placeholders are in the text,
+        # or in html restored before them, in stash order. convertToStream
+        # runs this on every fragment, so looping over the whole stash would
+        # make it quadratic.
+        todo = self.placeholderIndexes(text)
+        heapq.heapify(todo)
+        done = set(todo)
+        while todo:
+            i = heapq.heappop(todo)
+            html, safe = self.stashedHtml(i)
+            for j in self.placeholderIndexes(html):
+                if j > i and j not in done:
+                    done.add(j)
+                    heapq.heappush(todo, j)
             if self.isblocklevel(html) and (safe or not self.markdown.safeMode):
                 text = text.replace("<p>%s</p>" % 
                             (self.markdown.htmlStash.get_placeholder(i)),
@@ -67,6 +126,13 @@ class RawHtmlPostprocessor(Postprocessor):
                                  html)
         return text
 
+    def placeholderIndexes(self, text):
+        """ Return the stash indexes of the placeholders in text. """
+        counter = self.markdown.htmlStash.html_counter
+        return list(set(i for i in map(int,
+                                       util.HTML_PLACEHOLDER_RE.findall(text))
+                        if i < counter))
+
     def escape(self, html):
         """ Basic html escaping """
         html = html.replace('&', '&amp;')
@@ -87,6 +153,8 @@ class RawHtmlPostprocessor(Postprocessor):
 class AndSubstitutePostprocessor(Postprocessor):
     """ Restore valid entities """
 
+    streamable = True
+
     def run(self, text):
         text =  text.replace(util.AMP_SUBSTITUTE, "&")
         return text
@@ -95,6 +163,8 @@ class AndSubstitutePostprocessor(Postprocessor):
 class UnescapePostprocessor(Postprocessor):
     """ Restore escaped chars """
 
+    streamable = True
+
     RE = re.compile('%s(\d+)%s' % (util.STX, util.ETX))
 
     def unescape(self, m):
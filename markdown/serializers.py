@@ -49,7 +49,7 @@ else:
 PI = util.etree.PI
 ProcessingInstruction = util.etree.ProcessingInstruction
 
-__all__ = ['to_html_string', 'to_xhtml_string']
+__all__ = ['to_html_string', 'to_xhtml_string', 'write_html', 'write_xhtml']
 
 HTML_EMPTY = ("area", "base", "basefont", "br", "col", "frame", "hr",
               "img", "input", "isindex", "link", "meta" "param")
@@ -202,6 +202,19 @@ def _write_html(root,
     else:
         return _encode("".join(data))
 
+def _stream_html(write, root, skip_root=False, default_namespace=None,
+                 format="html"):
+    assert root is not None
+    qnames, namespaces = _namespaces(root, default_namespace)
+    if skip_root:
+        # write the contents of root as if it had no tag, and drop its tail
+        if root.text:
+            write(_escape_cdata(root.text))
+        for e in root:
+            _serialize_html(write, e, qnames, None, format)
+    else:
+        _serialize_html(write, root, qnames, namespaces, format)
+
 
 # --------------------------------------------------------------------
 # serialization support
@@ -274,3 +287,11 @@ def to_html_string(element):
 
 def to_xhtml_string(element):
     return _write_html(ElementTree(element).getroot(), format="xhtml")
+
+def write_html(write, element, skip_root=False):
+    _stream_html(write, ElementTree(element).getroot(), skip_root,
+                 format="html")
+
+def write_xhtml(write, element, skip_root=False):
+    _stream_html(write, ElementTree(element).getroot(), skip_root,
+                 format="xhtml")
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 from __future__ import absolute_import
+import re
 from . import util
 from . import odict
 from . import inlinepatterns
@@ -7,8 +8,16 @@ from . import inlinepatterns
 
 def build_treeprocessors(md_instance, **kwargs):
     """ Build the default treeprocessors for Markdown. """
+    try:
+        inline_class = inline_engines[md_instance.inline_engine]
+    except KeyError as e:
+        message = 'Invalid Inline Engine: "%s". Use one of "%s".' \
+                  % (md_instance.inline_engine,
+                     '", "'.join(sorted(inline_engines)))
+        e.args = (message,) + e.args[1:]
+        raise
     treeprocessors = odict.OrderedDict()
-    treeprocessors["inline"] = InlineProcessor(md_instance)
+    treeprocessors["inline"] = inline_class(md_instance)
     treeprocessors["prettify"] = PrettifyTreeprocessor(md_instance)
     return treeprocessors
 
@@ -223,7 +232,7 @@ class InlineProcessor(Treeprocessor):
         Returns: String with placeholders instead of ElementTree elements.
 
         """
-        match = pattern.getCompiledRegExp().match(data[startIndex:])
+        match = self._matchPattern(pattern, data, startIndex)
         leftData = data[:startIndex]
 
         if not match:
@@ -252,6 +261,16 @@ class InlineProcessor(Treeprocessor):
                              match.group(1),
                              placeholder, match.groups()[-1]), True, 0
 
+    def _matchPattern(self, pattern, data, startIndex):
+        """
+        Match pattern against data from startIndex on.
+
+        Returns a match whose first group is the text before the pattern and
+        whose last group is the text after it, or None.
+
+        """
+        return pattern.getCompiledRegExp().match(data[startIndex:])
+
     def run(self, tree):
         """Apply inline patterns to a parsed Markdown tree.
 
@@ -322,6 +341,143 @@ class InlineProcessor(Treeprocessor):
         return tree
 
 
+BACKREF_RE = re.compile(r'\\([1-9][0-9]?)(?![0-9])|\\.', re.DOTALL)
+
+
+def unanchorPattern(source):
+    """
+    Return the regular expression of an inline pattern without the group
+    that `inlinepatterns.Pattern` adds in front of it, renumbering its
+    backreferences to match, or None if it refers to that group.
+
+    """
+    def renumber(m):
+        if m.group(1) is None:
+            return m.group(0)
+        if m.group(1) == '1':
+            raise ValueError(source)
+        return '\\%d' % (int(m.group(1)) - 1)
+    try:
+        return BACKREF_RE.sub(renumber, source)
+    except ValueError:
+        return None
+
+
+class ScanMatch(object):
+    """
+    Wraps a match of an unanchored inline pattern so that it looks like a
+    match of the `^(.*?)pattern(.*?)$` regular expression built by
+    `inlinepatterns.Pattern`: group 1 is the text before the pattern, the
+    pattern's own groups follow and the last group is the text after it.
+
+    """
+
+    def __init__(self, match, string):
+        self.match = match
+        self.string = string
+        self.lastindex = len(match.groups()) + 2
+        # Without MULTILINE, a lazy `(.*?)$` stops before a final newline.
+        self.tail_end = len(string)
+        if string.endswith('\n') and match.end() < len(string):
+            self.tail_end -= 1
+
+    def span(self, group=0):
+        if not isinstance(group, int):
+            return self.match.span(group)
+        if group == 0:
+            return 0, self.tail_end
+        if group == 1:
+            return 0, self.match.start()
+        if 1 < group < self.lastindex:
+            return self.match.span(group - 1)
+        if group == self.lastindex:
+            return self.match.end(), self.tail_end
+        raise IndexError("no such group")
+
+    def group(self, *groups):
+        if len(groups) > 1:
+            return tuple(self.group(g) for g in groups)
+        group = groups[0] if groups else 0
+        if not isinstance(group, int):
+            return self.match.group(group)
+        if 1 < group < self.lastindex:
+            return self.match.group(group - 1)
+        start, end = self.span(group)
+        return self.string[start:end]
+
+    def groups(self):
+        return tuple(self.group(g) for g in range(1, self.lastindex + 1))
+
+
+class ScanningInlineProcessor(InlineProcessor):
+    """
+    An InlineProcessor which produces the same tree as InlineProcessor but
+    finds patterns faster.
+
+    Patterns are still applied one after the other, as their order decides
+    the result. But rather than matching the anchored `^(.*?)pattern(.*?)$`
+    regular expression, which backtracks over the text before and after
+    every match, a pattern is dispatched on the characters its matches can
+    start with (see `inlinepatterns.TRIGGER_CHARS`): it is skipped when the
+    text contains none of them and otherwise searched for from the first one.
+
+    Patterns which replace `getCompiledRegExp` or their compiled regular
+    expression are matched the classic way.
+
+    """
+
+    def __init__(self, md):
+        InlineProcessor.__init__(self, md)
+        self.scanners = {}
+
+    def _scanner(self, pattern):
+        """ Return (regexp, trigger regexp) for a pattern, or None. """
+        try:
+            return self.scanners[pattern]
+        except KeyError:
+            pass
+        scanner = None
+        source = getattr(pattern, 'pattern', None)
+        if isinstance(source, util.string_type) \
+                and type(pattern).getCompiledRegExp == \
+                    inlinepatterns.Pattern.getCompiledRegExp \
+                and pattern.compiled_re.pattern == "^(.*?)%s(.*?)$" % source:
+            unanchored = unanchorPattern(source)
+            if unanchored is not None:
+                triggers = inlinepatterns.TRIGGER_CHARS.get(source)
+                if triggers is not None:
+                    triggers = re.compile('[%s]' % re.escape(triggers))
+                scanner = (re.compile(unanchored, re.DOTALL | re.UNICODE),
+                           triggers)
+        self.scanners[pattern] = scanner
+        return scanner
+
+    def _matchPattern(self, pattern, data, startIndex):
+        scanner = self._scanner(pattern)
+        if scanner is None:
+            return InlineProcessor._matchPattern(self, pattern, data,
+                                                 startIndex)
+        regexp, triggers = scanner
+        if startIndex:
+            data = data[startIndex:]
+        pos = 0
+        if triggers is not None:
+            first = triggers.search(data)
+            if first is None:
+                return None
+            pos = first.start()
+        match = regexp.search(data, pos)
+        if match is None:
+            return None
+        return ScanMatch(match, data)
+
+
+inline_engines = {
+    'classic': InlineProcessor,
+    'scanner': ScanningInlineProcessor,
+}
+
+
 class PrettifyTreeprocessor(Treeprocessor):
     """ Add linebreaks to the html document. """
 
@@ -1,9 +1,18 @@
+import collections
 import json
 import logging
+import time
 
 import urllib
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
 
+import httpclient
+
+MAILCHIMP_TASK_URL = "/tasks/mailchimp"
+THANK_DEADLINE = 60
+
 class TestPledgeService(object):
   def loadPledgeInfo(self, user_token):
     if user_token.startswith("valid"):
@@ -16,6 +25,12 @@ class TestPledgeService(object):
   def getTeamTotal(self, team):
     return (51800, 7)
 
+  def getTeamTotals(self, teams):
+    return [self.getTeamTotal(team) for team in teams]
+
+  def loadPledgeInfos(self, user_tokens):
+    return [self.loadPledgeInfo(user_token) for user_token in user_tokens]
+
   def getLeaderboard(self, offset=None, limit=None, orderBy=None):
     return [{"total_cents": 100,
              "num_pledges": 2,
@@ -24,39 +39,145 @@ class TestPledgeService(object):
   def updateMailchimp(self, team):
     return None
 
+  # pretend every team has this many pledges, thanked THANK_BATCH_SIZE at a
+  # time, so thank you jobs run several batches
+  THANK_BATCH_SIZE = 3
+  THANK_TOTAL_PLEDGES = 7
+
+  def thankTeam(self, team_key, data, offset=None, limit=None):
+    offset = offset or 0
+    if limit is None:
+      limit = self.THANK_TOTAL_PLEDGES
+    return {"num_emailed": max(0, min(limit,
+                                      self.THANK_TOTAL_PLEDGES - offset)),
+            "total_pledges": self.THANK_TOTAL_PLEDGES}
+
 
 class ProdPledgeService(object):
-  def __init__(self, url):
+  # /r/thank emails all of a team's contributors in one request
+  THANK_BATCH_SIZE = None
+
+  def __init__(self, url, parallelism=10, client=None, breaker=None):
     self.url = url
+    # how many requests the batch methods have in flight at once
+    self.parallelism = parallelism
+    self.client = client or httpclient.SHARED
+    # every call goes through the breaker; while it is open they raise
+    # httpclient.CircuitOpen right away
+    self.breaker = breaker or httpclient.CircuitBreaker("pledge service")
 
-  def fetcher(self, url):
-    return urlfetch.fetch(url, follow_redirects=False,
-                          validate_certificate=True)      
+  def fetcher(self, url, endpoint="pledge"):
+    return self.breaker.call(self.client.fetch, endpoint, url)
                         
-  def poster(self, url, post_data):
+  def poster(self, url, post_data, endpoint="pledge", deadline=None):
     post_data_encoded = urllib.urlencode(post_data)
-    return urlfetch.fetch(url, follow_redirects=False,
+    return self.breaker.call(self.client.fetch, endpoint, url,
+                          deadline=deadline,
                           validate_certificate=False, 
                           method=urlfetch.POST, 
                           payload=post_data_encoded,
                           headers={'Content-Type': 'application/x-www-form-urlencoded'}) 
 
-  def loadPledgeInfo(self, user_token):
-    resp = self.fetcher("%s/user-info/%s" % (self.url, user_token))
+  def fetchAll(self, urls, endpoint="pledge"):
+    """Fetches urls in chunks of self.parallelism concurrent calls. Returns
+    the responses, or the exceptions raised, in urls order.
+    """
+    if self.breaker.state != httpclient.CircuitBreaker.CLOSED:
+      # one at a time, so a half open breaker gets its single probe
+      results = []
+      for url in urls:
+        try:
+          results.append(self.fetcher(url, endpoint))
+        except Exception as e:
+          results.append(e)
+      return results
+    results = []
+    for start in xrange(0, len(urls), self.parallelism):
+      calls = []
+      try:
+        for url in urls[start:start + self.parallelism]:
+          try:
+            calls.append(self.client.start(endpoint, url))
+          except Exception as e:
+            calls.append(e)
+        for call in calls:
+          try:
+            if isinstance(call, Exception):
+              raise call
+            results.append(self.breaker.call(call.get_result))
+          except httpclient.CircuitOpen as e:
+            # opened by an earlier call in this chunk. still wait for the
+            # response, which frees the call's client slot.
+            try:
+              call.get_result()
+            except Exception:
+              pass
+            results.append(e)
+          except Exception as e:
+            results.append(e)
+      finally:
+        # after a BaseException such as DeadlineExceededError, calls not
+        # waited for would keep their client slots
+        for call in calls:
+          if not isinstance(call, Exception):
+            call.abandon()
+    return results
+
+  def _pledgeInfoURL(self, user_token):
+    return "%s/user-info/%s" % (self.url, user_token)
+
+  def _parsePledgeInfo(self, resp):
     if resp.status_code == 404:
       return None
     if resp.status_code != 200:
       raise Exception("Unexpected authentication error: %s", resp.content)
     return json.loads(resp.content)["user"]
 
-  def getTeamTotal(self, team):
-    resp = self.fetcher("%s/total?team=%s" % (self.url, str(team.key())))
+  def _teamTotalURL(self, team):
+    return "%s/total?team=%s" % (self.url, str(team.key()))
+
+  def _parseTeamTotal(self, resp):
     if resp.status_code != 200:
       raise Exception("unexpected total error %d: %s", resp.status_code,
           resp.content)
     return tuple(map(int,
         resp.content.replace("(", "").replace(")", "").split(",")))
 
+  def _batch(self, urls, parse, endpoint):
+    results = []
+    for url, resp in zip(urls, self.fetchAll(urls, endpoint)):
+      try:
+        if isinstance(resp, Exception):
+          raise resp
+        results.append(parse(resp))
+      except Exception:
+        logging.exception("batch fetch of %s failed", url)
+        results.append(None)
+    return results
+
+  def loadPledgeInfo(self, user_token):
+    return self._parsePledgeInfo(
+        self.fetcher(self._pledgeInfoURL(user_token), "pledge.user-info"))
+
+  def loadPledgeInfos(self, user_tokens):
+    """loadPledgeInfo for many tokens at once. Returns a list in
+    user_tokens order, with None for unknown tokens and failed fetches.
+    """
+    return self._batch([self._pledgeInfoURL(user_token)
+                        for user_token in user_tokens],
+                       self._parsePledgeInfo, "pledge.user-info")
+
+  def getTeamTotal(self, team):
+    return self._parseTeamTotal(
+        self.fetcher(self._teamTotalURL(team), "pledge.total"))
+
+  def getTeamTotals(self, teams):
+    """getTeamTotal for many teams at once. Returns a list in teams order,
+    with None for failed fetches.
+    """
+    return self._batch([self._teamTotalURL(team) for team in teams],
+                       self._parseTeamTotal, "pledge.total")
+
   def getLeaderboard(self, offset=None, limit=None, orderBy=None):
     params = {}
     if offset is not None:
@@ -67,12 +188,30 @@ class ProdPledgeService(object):
       params["orderBy"] = orderBy
     
     resp = self.fetcher("%s/r/leaderboard?%s" % (
-        self.url, urllib.urlencode(params)))
+        self.url, urllib.urlencode(params)), "pledge.leaderboard")
     if resp.status_code != 200:
       raise Exception("unexpected leaderboard error %d: %s", resp.status_code,
                       resp.content)
     return json.loads(resp.content)["teams"]
 
+  def thankTeam(self, team_key, data, offset=None, limit=None):
+    """Has the pledge service email data["message_body"] to the team's
+    contributors. Returns the num_emailed and total_pledges counts.
+    """
+    post_data = dict((k, unicode(v).encode("utf-8"))
+                     for k, v in data.iteritems())
+    post_data["team"] = team_key
+    if offset is not None:
+      post_data["offset"] = offset
+    if limit is not None:
+      post_data["limit"] = limit
+    # runs in a task, and the pledge service emails everyone before answering
+    resp = self.poster("%s/r/thank" % self.url, post_data, "pledge.thank",
+                       deadline=THANK_DEADLINE)
+    if resp.status_code != 200:
+      raise Exception(resp.content)
+    return json.loads(resp.content)
+
   def updateMailchimp(self, team):
     user_info = self.loadPledgeInfo(team.user_token)       
     #logging.info("UT: " + str(team.user_token))
@@ -84,7 +223,77 @@ class ProdPledgeService(object):
       }
       url = "%s/r/subscribe" % self.url
       #logging.info("OK we are posting:" + str(form_fields))      
-      result = self.poster(url=url, post_data=form_fields)
+      result = self.poster(url=url, post_data=form_fields,
+                           endpoint="pledge.subscribe")
       return result
     else:
       return None
+
+
+class TaskQueueMailchimpQueue(object):
+  """Runs mailchimp updates in MAILCHIMP_TASK_URL tasks on the mailchimp
+  queue, which retries failures with backoff (see queue.yaml). An update
+  only carries the team key, so edits made while a team's task is still
+  waiting out its countdown are folded into that task.
+  """
+
+  def __init__(self, queue_name="mailchimp", countdown=10):
+    self.queue_name = queue_name
+    self.countdown = countdown
+
+  def _pendingKey(self, team_key):
+    return "mailchimp_pending:%s" % team_key
+
+  def enqueue(self, team_key):
+    pending = self._pendingKey(team_key)
+    if not memcache.add(pending, True, self.countdown * 6):
+      return
+    try:
+      taskqueue.add(queue_name=self.queue_name, url=MAILCHIMP_TASK_URL,
+                    params={"team": team_key}, countdown=self.countdown)
+    except Exception:
+      memcache.delete(pending)
+      raise
+
+  def started(self, team_key):
+    """Called by the task before it loads the team, so later edits enqueue
+    a new update.
+    """
+    memcache.delete(self._pendingKey(team_key))
+
+
+class LocalMailchimpQueue(object):
+  """An in process stand-in for TaskQueueMailchimpQueue for tests. Updates
+  wait in the queue, one per team, until flush runs them with retries.
+  """
+
+  def __init__(self, max_attempts=5, min_backoff=1, sleep=time.sleep):
+    self.max_attempts = max_attempts
+    self.min_backoff = min_backoff
+    self.sleep = sleep
+    self.pending = collections.OrderedDict()
+
+  def enqueue(self, team_key):
+    self.pending[team_key] = True
+
+  def started(self, team_key):
+    pass
+
+  def flush(self, update):
+    """Calls update(team_key) for every pending team, retrying failures
+    with doubling backoff. Returns the team keys that still failed.
+    """
+    failed = []
+    while self.pending:
+      team_key, _ = self.pending.popitem(last=False)
+      for attempt in xrange(self.max_attempts):
+        try:
+          update(team_key)
+          break
+        except Exception:
+          logging.exception("mailchimp update for %s failed", team_key)
+          if attempt + 1 < self.max_attempts:
+            self.sleep(self.min_backoff * 2 ** attempt)
+      else:
+        failed.append(team_key)
+    return failed
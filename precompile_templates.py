@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""Compiles every template under templates/ into compiled_templates/, which
+templating.environment loads from while it matches the sources and the
+jinja2 version running. Run it before each deploy, with the jinja2 version
+app.yaml deploys:
+
+  python precompile_templates.py
+"""
+
+import json
+import os
+import shutil
+import sys
+
+import jinja2
+
+import templating
+
+
+def main():
+  env = templating.makeEnvironment(
+      jinja2.FileSystemLoader(templating.TEMPLATE_DIR + "/"))
+  if os.path.exists(templating.COMPILED_DIR):
+    shutil.rmtree(templating.COMPILED_DIR)
+  os.mkdir(templating.COMPILED_DIR)
+  env.compile_templates(templating.COMPILED_DIR, zip=None,
+                        ignore_errors=False)
+  manifest = templating.manifest()
+  with open(os.path.join(templating.COMPILED_DIR,
+                         templating.MANIFEST), "w") as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  sys.stdout.write("compiled %d templates into %s with jinja2 %s\n" % (
+      len(manifest["templates"]), templating.COMPILED_DIR,
+      manifest["jinja2"]))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,110 @@
+"""The jinja2 environment for templates/.
+
+precompile_templates.py compiles every template into COMPILED_DIR ahead of
+deploys. When those modules match the current sources and were compiled by
+the jinja2 version running, templates load from them without parsing or
+compiling anything; otherwise they are compiled from templates/, with the
+bytecode cached in memcache across instances.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import urllib
+
+import jinja2
+
+TEMPLATE_DIR = "templates"
+COMPILED_DIR = "compiled_templates"
+MANIFEST = "manifest.json"
+
+
+def makeEnvironment(loader, bytecode_cache=None):
+  env = jinja2.Environment(
+    loader=loader,
+    extensions=['jinja2.ext.autoescape'],
+    autoescape=True,
+    bytecode_cache=bytecode_cache)
+  env.filters["urlencode"] = \
+      lambda s: urllib.quote(s.encode('ascii', errors='ignore'), safe="")
+  return env
+
+
+def templateNames():
+  return jinja2.FileSystemLoader(TEMPLATE_DIR).list_templates()
+
+
+def sourceHashes():
+  """Returns a dict from template name to the sha1 of its source."""
+  hashes = {}
+  for name in templateNames():
+    with open(os.path.join(TEMPLATE_DIR, name), "rb") as f:
+      hashes[name] = hashlib.sha1(f.read()).hexdigest()
+  return hashes
+
+
+def manifest():
+  """What precompile_templates.py records about the compiled templates."""
+  return {"jinja2": jinja2.__version__, "templates": sourceHashes()}
+
+
+def compiledIsCurrent():
+  try:
+    with open(os.path.join(COMPILED_DIR, MANIFEST)) as f:
+      compiled = json.load(f)
+  except (IOError, ValueError):
+    return False
+  if not isinstance(compiled, dict) or \
+      compiled.get("jinja2") != jinja2.__version__:
+    # the generated code only runs on the jinja2 version that made it
+    logging.warning("%s was not compiled by jinja2 %s, run "
+                    "precompile_templates.py with it", COMPILED_DIR,
+                    jinja2.__version__)
+    return False
+  if compiled.get("templates") != sourceHashes():
+    logging.warning("%s is out of date, run precompile_templates.py",
+                    COMPILED_DIR)
+    return False
+  return True
+
+
+class _CompiledLoader(jinja2.ModuleLoader):
+  """A ModuleLoader which reports a compiled template that fails to load
+  as not found, so _FallbackLoader falls back to the source.
+  """
+
+  def load(self, environment, name, globals=None):
+    try:
+      return jinja2.ModuleLoader.load(self, environment, name, globals)
+    except jinja2.TemplateNotFound:
+      raise
+    except Exception:
+      logging.exception("compiled template %s failed to load", name)
+      raise jinja2.TemplateNotFound(name)
+
+
+class _FallbackLoader(jinja2.ChoiceLoader):
+  """A ChoiceLoader which loads through each loader's own load. jinja2 2.6's
+  ChoiceLoader only asks its loaders for sources, which a ModuleLoader
+  can't give.
+  """
+
+  def load(self, environment, name, globals=None):
+    for loader in self.loaders:
+      try:
+        return loader.load(environment, name, globals)
+      except jinja2.TemplateNotFound:
+        pass
+    raise jinja2.TemplateNotFound(name)
+
+
+def environment(memcache_client):
+  """Returns the environment the app renders with."""
+  loader = jinja2.FileSystemLoader(TEMPLATE_DIR + "/")
+  if compiledIsCurrent():
+    loader = _FallbackLoader([_CompiledLoader(COMPILED_DIR), loader])
+  return makeEnvironment(
+      loader,
+      jinja2.MemcachedBytecodeCache(memcache_client,
+                                    prefix="jinja2/bytecode/"))
@@ -0,0 +1,101 @@
+"""Helpers for tests that need the App Engine SDK.
+
+google.appengine has to be importable, or APPENGINE_SDK set to the SDK
+directory; tests that need it are skipped otherwise. Run them from the
+repository root, which main's template paths are relative to. When there
+is no config_NOCOMMIT.py, main is configured from config_NOCOMMIT_README.
+"""
+
+import imp
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fixPath():
+  sdk = os.environ.get("APPENGINE_SDK")
+  if sdk and sdk not in sys.path:
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def sdkPath():
+  """The SDK directory, or None."""
+  _fixPath()
+  try:
+    import google.appengine
+  except ImportError:
+    return None
+  return os.path.dirname(os.path.dirname(os.path.dirname(
+      os.path.abspath(google.appengine.__file__))))
+
+
+def importMain():
+  if "config_NOCOMMIT" not in sys.modules:
+    try:
+      import config_NOCOMMIT
+    except ImportError:
+      path = os.path.join(ROOT, "config_NOCOMMIT_README")
+      config = imp.new_module("config_NOCOMMIT")
+      config.__file__ = path
+      with open(path) as f:
+        exec(compile(f.read(), path, "exec"), config.__dict__)
+      sys.modules["config_NOCOMMIT"] = config
+  import main
+  return main
+
+
+class TestCase(unittest.TestCase):
+  """Runs each test against fresh datastore, memcache, urlfetch and task
+  queue stubs.
+  """
+
+  def setUp(self):
+    if sdkPath() is None:
+      raise unittest.SkipTest("needs the App Engine SDK, see APPENGINE_SDK")
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+    self.testbed = testbed.Testbed()
+    self.testbed.setup_env(app_id="dev~mayday-pac-teams", overwrite=True)
+    self.testbed.activate()
+    self.addCleanup(self.testbed.deactivate)
+    self.testbed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    self.testbed.init_memcache_stub()
+    self.testbed.init_urlfetch_stub()
+    self.testbed.init_taskqueue_stub(root_path=ROOT)
+    self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+  def tasks(self, queue_name="default"):
+    return self.taskqueue.get_filtered_tasks(queue_names=[queue_name])
+
+  def runTask(self, app, task):
+    """Runs a queued task against app, the way the queue would. Returns the
+    response status.
+    """
+    import webapp2
+    request = webapp2.Request.blank(task.url, method=task.method,
+                                    headers=task.headers)
+    request.body = task.payload or ""
+    return request.get_response(app).status_int
+
+  def runTasks(self, app, queue_name="default", limit=100):
+    """Runs queue_name's tasks, and the ones they add, until it is empty.
+    A failed task is run again, as the queue would retry it. Returns the
+    response statuses in order.
+    """
+    statuses = []
+    while len(statuses) < limit:
+      tasks = self.tasks(queue_name)
+      if not tasks:
+        return statuses
+      for task in tasks:
+        status = self.runTask(app, task)
+        statuses.append(status)
+        if status < 300:
+          self.taskqueue.DeleteTask(queue_name, task.name)
+    raise AssertionError("%s queue didn't empty" % queue_name)
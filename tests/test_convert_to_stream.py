@@ -0,0 +1,128 @@
+"""Checks that Markdown.convertToStream writes exactly what convert returns,
+on random documents built from markdown fragments.
+
+  python -m unittest tests.test_convert_to_stream
+  python -m tests.test_convert_to_stream [--docs N] [--seed N]
+
+The script form fuzzes more documents and prints the first mismatch.
+"""
+
+import argparse
+import random
+import sys
+import unittest
+
+import markdown
+from tests import test_inline_engines
+
+# raw html blocks, which RawHtmlPostprocessor unwraps from their paragraphs
+BLOCK_FRAGMENTS = [
+    "\n\n<div>\n*x*\n</div>\n\n", "\n\n<div class=\"a\">b</div>\n\n",
+    "\n\n<!-- block -->\n\n", "\n\n<p>raw *p*</p>\n\n", "\n\n<hr>\n\n",
+    "\n\n<hr/>\n\n", "\n\n<div markdown=\"1\">\n*md*\n</div>\n\n",
+    "\n\n<table><tr><td>t</td></tr></table>\n\n", "\n\n<script>s</script>\n\n",
+    "<div>", "</div>", "\n\n<?php p ?>\n\n", "\n\n<pre>\n  x\n</pre>\n\n",
+]
+
+FRAGMENTS = test_inline_engines.FRAGMENTS + BLOCK_FRAGMENTS
+
+CONFIGS = [
+    {},
+    {"output_format": "html5"},
+    {"output_format": "xhtml1"},
+    {"output_format": "xhtml5", "extensions": ["extra"]},
+    {"extensions": ["footnotes"]},
+    {"extensions": ["footnotes"], "output_format": "xhtml1"},
+    {"extensions": ["extra", "smarty"]},
+    {"safe_mode": True},
+    {"safe_mode": "escape"},
+    {"safe_mode": "remove", "output_format": "xhtml1"},
+    {"safe_mode": "replace", "extensions": ["footnotes", "attr_list"]},
+    {"safe_mode": "escape", "enable_attributes": False,
+     "output_format": "html5"},
+]
+
+
+class Recorder(object):
+  """A stream that keeps what is written to it."""
+
+  def __init__(self):
+    self.writes = []
+
+  def write(self, text):
+    self.writes.append(text)
+
+  def getvalue(self):
+    return u"".join(self.writes)
+
+
+def randomDocument(rng):
+  return "".join(rng.choice(FRAGMENTS)
+                 for _ in range(rng.randint(1, 60)))
+
+
+def streamed(text, config):
+  output = Recorder()
+  markdown.Markdown(**config).convertToStream(text, output)
+  return output
+
+
+def firstMismatch(docs, seed):
+  """Returns (config, document, converted html, streamed html) for the first
+  document convertToStream gets wrong, or None.
+  """
+  rng = random.Random(seed)
+  for i in range(docs):
+    text = randomDocument(rng)
+    config = CONFIGS[i % len(CONFIGS)]
+    converted = markdown.Markdown(**config).convert(text)
+    stream = streamed(text, config).getvalue()
+    if converted != stream:
+      return config, text, converted, stream
+  return None
+
+
+class ConvertToStreamTest(unittest.TestCase):
+
+  def testStreamMatchesConvert(self):
+    mismatch = firstMismatch(1500, 0)
+    if mismatch is not None:
+      self.fail("convertToStream differs for %r on %r:\n%s\n---\n%s" %
+                mismatch)
+
+  def testStreamsInFragments(self):
+    # the configs above don't fall back to a single convert
+    text = "a\n\n<div>b</div>\n\nc[^1]\n\n[^1]: d"
+    for config in CONFIGS:
+      self.assertGreater(len(streamed(text, config).writes), 1, config)
+
+  def testEmptyDocument(self):
+    for text in [u"", u"\n\n", u"   "]:
+      for config in CONFIGS:
+        self.assertEqual(markdown.Markdown(**config).convert(text),
+                         streamed(text, config).getvalue())
+
+  def testLongDocument(self):
+    rng = random.Random(1)
+    text = "\n\n".join(randomDocument(rng) for _ in range(200))
+    for config in CONFIGS:
+      self.assertEqual(markdown.Markdown(**config).convert(text),
+                       streamed(text, config).getvalue())
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--docs", type=int, default=20000)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  mismatch = firstMismatch(args.docs, args.seed)
+  if mismatch is None:
+    sys.stdout.write("%d documents streamed the same\n" % args.docs)
+    return
+  sys.stdout.write("convertToStream differs for %r on %r:\n%s\n---\n%s\n" %
+                   mismatch)
+  sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,222 @@
+"""Tests for HttpClient and CircuitBreaker, over FakeTransport."""
+
+import unittest
+
+from tests import appengine
+
+
+class Deadline(BaseException):
+  """Stands in for google.appengine.runtime.DeadlineExceededError."""
+
+
+class HttpClientTest(unittest.TestCase):
+
+  def setUp(self):
+    if appengine.sdkPath() is None:
+      raise unittest.SkipTest("needs the App Engine SDK, see APPENGINE_SDK")
+    import httpclient
+    self.httpclient = httpclient
+    self.transport = httpclient.FakeTransport()
+    self.client = httpclient.HttpClient(self.transport, max_in_flight=2,
+                                        queue_timeout=0)
+
+  def testFetch(self):
+    self.transport.route("http://pledge/ok",
+                         self.httpclient.FakeResponse(200, "yes"))
+    response = self.client.fetch("ok", "http://pledge/ok")
+    self.assertEqual("yes", response.content)
+    self.assertEqual(404, self.client.fetch("other", "http://other").status_code)
+    self.assertEqual(["http://pledge/ok", "http://other"],
+                     [url for _, url, _, _ in self.transport.requests])
+    stats = self.client.stats
+    self.assertEqual(0, stats["in_flight"])
+    self.assertEqual(1, stats["endpoints"]["ok"]["count"])
+    self.assertEqual(0, stats["endpoints"]["ok"]["errors"])
+
+  def testBusy(self):
+    calls = [self.client.start("e", "http://a"),
+             self.client.start("e", "http://b")]
+    self.assertRaises(self.httpclient.HttpClientBusy,
+                      self.client.start, "e", "http://c")
+    calls[0].get_result()
+    self.client.start("e", "http://c").get_result()
+    calls[1].abandon()
+    calls[1].abandon()
+    self.assertEqual(0, self.client.stats["in_flight"])
+
+  def testStartFailureFreesSlot(self):
+    def fail(*args):
+      raise ValueError("bad url")
+    self.transport.start = fail
+    for _ in range(3):
+      self.assertRaises(ValueError, self.client.start, "e", "http://a")
+    self.assertEqual(0, self.client.stats["in_flight"])
+
+  def testErrorsAreCounted(self):
+    self.transport.route("http://down", self.httpclient.FakeResponse(503))
+    self.transport.route("http://gone", IOError("reset"))
+    self.client.fetch("e", "http://down")
+    self.assertRaises(IOError, self.client.fetch, "e", "http://gone")
+    self.assertEqual(2, self.client.stats["endpoints"]["e"]["errors"])
+    self.assertEqual(0, self.client.stats["in_flight"])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+  def setUp(self):
+    if appengine.sdkPath() is None:
+      raise unittest.SkipTest("needs the App Engine SDK, see APPENGINE_SDK")
+    import httpclient
+    self.httpclient = httpclient
+    self.now = [1000.0]
+    self.addCleanup(setattr, httpclient.time, "time", httpclient.time.time)
+    httpclient.time.time = lambda: self.now[0]
+
+  def breaker(self, **kwargs):
+    kwargs.setdefault("window", 4)
+    kwargs.setdefault("min_calls", 4)
+    kwargs.setdefault("open_seconds", 30)
+    return self.httpclient.CircuitBreaker("test", **kwargs)
+
+  def ok(self):
+    return self.httpclient.FakeResponse(200)
+
+  def fail(self):
+    raise IOError("down")
+
+  def trip(self, breaker):
+    for _ in range(4):
+      self.assertRaises(IOError, breaker.call, self.fail)
+    self.assertEqual(breaker.OPEN, breaker.state)
+
+  def testTripsOnErrors(self):
+    breaker = self.breaker()
+    for _ in range(2):
+      breaker.call(self.ok)
+      self.assertRaises(IOError, breaker.call, self.fail)
+    self.assertEqual(breaker.OPEN, breaker.state)
+    self.assertRaises(self.httpclient.CircuitOpen, breaker.call, self.ok)
+    self.assertEqual(1, breaker.stats["trips"])
+    self.assertEqual(1, breaker.stats["rejected"])
+
+  def testServerErrorsFail(self):
+    breaker = self.breaker()
+    for _ in range(4):
+      breaker.call(lambda: self.httpclient.FakeResponse(500))
+    self.assertEqual(breaker.OPEN, breaker.state)
+
+  def testTripsOnSlowCalls(self):
+    breaker = self.breaker(slow_ms=100)
+
+    def slow():
+      self.now[0] += 1
+      return self.ok()
+    for _ in range(4):
+      breaker.call(slow)
+    self.assertEqual(breaker.OPEN, breaker.state)
+
+  def testStaysClosedBelowMinCalls(self):
+    breaker = self.breaker()
+    for _ in range(3):
+      self.assertRaises(IOError, breaker.call, self.fail)
+    self.assertEqual(breaker.CLOSED, breaker.state)
+
+  def testHalfOpenProbeRecovers(self):
+    breaker = self.breaker()
+    self.trip(breaker)
+    self.now[0] += 30
+    self.assertEqual(breaker.HALF_OPEN, breaker.state)
+    seen = []
+
+    def probe():
+      # a second call while the probe is in flight is rejected
+      self.assertRaises(self.httpclient.CircuitOpen, breaker.call, self.ok)
+      seen.append(True)
+      return self.ok()
+    breaker.call(probe)
+    self.assertEqual([True], seen)
+    self.assertEqual(breaker.CLOSED, breaker.state)
+    breaker.call(self.ok)
+
+  def testFailedProbeReopens(self):
+    breaker = self.breaker()
+    self.trip(breaker)
+    self.now[0] += 30
+    self.assertRaises(IOError, breaker.call, self.fail)
+    self.assertEqual(breaker.OPEN, breaker.state)
+    self.assertEqual(2, breaker.stats["trips"])
+
+  def testBaseExceptionInProbeReopens(self):
+    breaker = self.breaker()
+    self.trip(breaker)
+    self.now[0] += 30
+
+    def deadline():
+      raise Deadline()
+    self.assertRaises(Deadline, breaker.call, deadline)
+    self.assertEqual(breaker.OPEN, breaker.state)
+    self.now[0] += 30
+    breaker.call(self.ok)
+    self.assertEqual(breaker.CLOSED, breaker.state)
+
+  def testIgnoredExceptionsDontCount(self):
+    breaker = self.breaker()
+
+    def busy():
+      raise self.httpclient.HttpClientBusy("no slots")
+    for _ in range(10):
+      self.assertRaises(self.httpclient.HttpClientBusy, breaker.call, busy)
+    self.assertEqual(breaker.CLOSED, breaker.state)
+    self.assertEqual(0, breaker.stats["recent_calls"])
+    self.assertEqual(10, breaker.stats["ignored"])
+
+  def testIgnoredExceptionReleasesProbe(self):
+    breaker = self.breaker()
+    self.trip(breaker)
+    self.now[0] += 30
+
+    def busy():
+      raise self.httpclient.HttpClientBusy("no slots")
+    self.assertRaises(self.httpclient.HttpClientBusy, breaker.call, busy)
+    self.assertEqual(breaker.HALF_OPEN, breaker.state)
+    breaker.call(self.ok)
+    self.assertEqual(breaker.CLOSED, breaker.state)
+
+
+class FetchAllTest(unittest.TestCase):
+
+  def setUp(self):
+    if appengine.sdkPath() is None:
+      raise unittest.SkipTest("needs the App Engine SDK, see APPENGINE_SDK")
+    import httpclient
+    import pledge
+    self.httpclient = httpclient
+    self.transport = httpclient.FakeTransport()
+    self.client = httpclient.HttpClient(self.transport, max_in_flight=10,
+                                        queue_timeout=0)
+    self.service = pledge.ProdPledgeService(
+        "http://pledge", parallelism=4, client=self.client,
+        breaker=httpclient.CircuitBreaker("test"))
+
+  def testResultsInOrder(self):
+    self.transport.route("http://pledge/down", IOError("reset"))
+    self.transport.route("http://pledge/",
+                         lambda url, *args: self.httpclient.FakeResponse(
+                             200, url))
+    urls = ["http://pledge/%d" % i for i in range(6)] + ["http://pledge/down"]
+    results = self.service.fetchAll(urls)
+    self.assertEqual(urls[:6], [r.content for r in results[:6]])
+    self.assertIsInstance(results[6], IOError)
+    self.assertEqual(0, self.client.stats["in_flight"])
+
+  def testBaseExceptionFreesSlots(self):
+    self.transport.route("http://pledge/deadline", Deadline())
+    self.transport.route("http://pledge/", self.httpclient.FakeResponse(200))
+    urls = ["http://pledge/deadline"] + ["http://pledge/%d" % i
+                                         for i in range(3)]
+    self.assertRaises(Deadline, self.service.fetchAll, urls)
+    self.assertEqual(0, self.client.stats["in_flight"])
+
+
+if __name__ == "__main__":
+  unittest.main()
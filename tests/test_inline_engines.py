@@ -0,0 +1,93 @@
+"""Checks that the scanning inline engine renders exactly what the classic
+one does, on random documents built from markdown fragments.
+
+  python -m unittest tests.test_inline_engines
+  python -m tests.test_inline_engines [--docs N] [--seed N]
+
+The script form fuzzes more documents and prints the first mismatch.
+"""
+
+import argparse
+import random
+import sys
+import unittest
+
+import markdown
+
+FRAGMENTS = [
+    "word", " ", "  ", "\n", "\n\n", "*", "**", "***", "_", "__", "`", "``",
+    "\\", "\\*", "\\`", "[", "]", "(", ")", "![", "<", ">", "&", "&amp;",
+    "&#42;", "&copy;", "'", '"', "--", "---", "...", "<<", ">>", "#", "-",
+    "+", "1.", "|", ":", "~", "=", "^", "{", "}", ".", "!", "http://a.b/c",
+    "<http://x.y/z>", "<me@example.com>", "[link](http://a.b \"t\")",
+    "![img](/i.png)", "[ref][r]", "[r]", "\n\n[r]: http://r.s/", "<b>",
+    "</b>", "<span class=\"x\">", "</span>", "<!-- c -->", "[[Wiki Link]]",
+    "*[ABBR]: Abbreviation", "ABBR", "[^1]", "\n\n[^1]: note", "{: .cls}",
+    "    code\n", "\n```\nfenced\n```\n", "a_b_c", "foo_bar", "x*y*z",
+]
+
+CONFIGS = [
+    {},
+    {"extensions": ["extra"]},
+    {"extensions": ["smarty", "wikilinks", "abbr", "nl2br"]},
+    {"extensions": ["smart_strong", "footnotes", "attr_list"]},
+    {"safe_mode": "escape"},
+    {"safe_mode": "replace", "enable_attributes": False},
+    {"output_format": "html5", "smart_emphasis": False},
+]
+
+
+def randomDocument(rng):
+  return "".join(rng.choice(FRAGMENTS)
+                 for _ in range(rng.randint(1, 60)))
+
+
+def render(text, engine, config):
+  return markdown.Markdown(inline_engine=engine, **config).convert(text)
+
+
+def firstMismatch(docs, seed):
+  """Returns (config, document, classic html, scanner html) for the first
+  document the engines disagree on, or None.
+  """
+  rng = random.Random(seed)
+  for i in range(docs):
+    text = randomDocument(rng)
+    config = CONFIGS[i % len(CONFIGS)]
+    classic = render(text, "classic", config)
+    scanner = render(text, "scanner", config)
+    if classic != scanner:
+      return config, text, classic, scanner
+  return None
+
+
+class InlineEnginesTest(unittest.TestCase):
+
+  def testScannerMatchesClassic(self):
+    mismatch = firstMismatch(1500, 0)
+    if mismatch is not None:
+      self.fail("engines differ for %r on %r:\n%s\n---\n%s" % mismatch)
+
+  def testLongDocument(self):
+    rng = random.Random(1)
+    text = "\n\n".join(randomDocument(rng) for _ in range(200))
+    for config in CONFIGS:
+      self.assertEqual(render(text, "classic", config),
+                       render(text, "scanner", config))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--docs", type=int, default=20000)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  mismatch = firstMismatch(args.docs, args.seed)
+  if mismatch is None:
+    sys.stdout.write("%d documents rendered the same\n" % args.docs)
+    return
+  sys.stdout.write("engines differ for %r on %r:\n%s\n---\n%s\n" % mismatch)
+  sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
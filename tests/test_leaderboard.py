@@ -0,0 +1,136 @@
+"""Tests for the local leaderboard: LeaderboardIndex ordering and paging,
+cursor links and the snapshot task.
+"""
+
+import datetime
+import urlparse
+import unittest
+
+from tests import appengine
+
+
+class LeaderboardIndexTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+    self.index = self.main.LeaderboardIndex(
+        3600, datetime.timedelta(seconds=60))
+    self.patch(self.main, "LEADERBOARD_INDEX", self.index)
+
+  def patch(self, owner, name, value):
+    if hasattr(owner, name):
+      self.addCleanup(setattr, owner, name, getattr(owner, name))
+    else:
+      self.addCleanup(delattr, owner, name)
+    setattr(owner, name, value)
+
+  def load(self, totals):
+    self.index._replace(totals, datetime.datetime.utcnow())
+
+  def teams(self, orderBy):
+    return [key[2] for key in self.index._sorted[orderBy]]
+
+  def pageTeams(self, *args, **kwargs):
+    _, rows = self.index.page(*args, **kwargs)
+    return [row["team"] for row in rows]
+
+  def testUpdateKeepsOrder(self):
+    self.load({"a": (100, 1), "b": (300, 2), "c": (200, 5)})
+    self.assertEqual(["b", "c", "a"], self.teams("-totalCents"))
+    self.assertEqual(["c", "b", "a"], self.teams("-num_pledges"))
+    self.index._update({"a": (400, 1), "d": (200, 5), "b": (300, 2)},
+                       datetime.datetime.utcnow())
+    # ties break on the other total, then the team key
+    self.assertEqual(["a", "b", "c", "d"], self.teams("-totalCents"))
+    self.assertEqual(["c", "d", "b", "a"], self.teams("-num_pledges"))
+    self.assertEqual(2, self.index.stats["updates"])
+    self.assertEqual(4, self.index.stats["teams"])
+
+  def testUpdateMovesTeamDown(self):
+    self.load({"a": (100, 1), "b": (300, 2), "c": (200, 5)})
+    self.index._update({"b": (50, 9)}, datetime.datetime.utcnow())
+    self.assertEqual(["c", "a", "b"], self.teams("-totalCents"))
+    self.assertEqual(["b", "c", "a"], self.teams("-num_pledges"))
+
+  def testKeysetPaging(self):
+    self.load(dict(("t%d" % i, (1000 - i, 1)) for i in range(10)))
+    _, first = self.index.page(3, "-totalCents")
+    self.assertEqual(["t0", "t1", "t2"], [row["team"] for row in first])
+    # a team from a later page climbs to the top between two pages
+    self.index._update({"t8": (5000, 1)}, datetime.datetime.utcnow())
+    start, second = self.index.page(3, "-totalCents", after=first[-1]["key"])
+    self.assertEqual(["t3", "t4", "t5"], [row["team"] for row in second])
+    self.assertEqual(4, start)
+    # the rows right before t3, which now include t2
+    self.assertEqual(["t0", "t1", "t2"], self.pageTeams(
+        3, "-totalCents", before=second[0]["key"]))
+    self.assertEqual(["t3", "t4"], self.pageTeams(
+        2, "-totalCents", offset=4))
+
+  def testCursorLinks(self):
+    self.patch(self.main.config_NOCOMMIT, "local_leaderboard", True)
+    totals = {}
+    for i in range(7):
+      team = self.main.Team.create(title="Team %d" % i, description="d",
+                                   primary_slug="team-%d" % i)
+      totals[str(team.key())] = (10000 * (i + 1), 1)
+    self.load(totals)
+    titles, link = [], None
+    while True:
+      cursor = urlparse.parse_qs(link[1:])["cursor"][0] if link else None
+      teams, prev_link, link = self.main.leaderboardGetter(
+          0, 3, "-totalCents", cursor)
+      self.assertEqual(bool(titles), prev_link is not None)
+      titles.extend(team["title"] for team in teams)
+      if link is None:
+        break
+    self.assertEqual(["Team %d" % i for i in reversed(range(7))], titles)
+
+  def saveTotals(self):
+    for i in range(3):
+      self.main.TeamTotals(key_name="team%d" % i, cents=100 * i,
+                           pledges=i).put()
+
+  def snapshotTask(self):
+    return self.main.webapp2.Request.blank(
+        "/tasks/leaderboard/snapshot").get_response(self.main.app)
+
+  def testRequestsDontScan(self):
+    self.patch(self.main.config_NOCOMMIT, "local_leaderboard", True)
+    self.saveTotals()
+    self.assertIsNone(self.index.page(10, "-totalCents"))
+    # served by the pledge service meanwhile
+    calls = []
+    self.patch(self.main.LEADERBOARD_CACHE, "get",
+               lambda *args: calls.append(args) or [])
+    self.main.leaderboardGetter(0, 10, "-totalCents")
+    self.assertEqual([(0, 10, "-totalCents")], calls)
+    self.assertEqual(0, self.index.stats["rebuilds"])
+    self.assertIsNone(self.main.LeaderboardSnapshot.get_by_key_name(
+        self.main.LeaderboardSnapshot.KEY_NAME))
+
+  def testSnapshotTaskBuildsIndex(self):
+    self.patch(self.main.config_NOCOMMIT, "local_leaderboard", True)
+    self.saveTotals()
+    self.assertEqual(200, self.snapshotTask().status_int)
+    self.assertEqual(1, self.index.stats["rebuilds"])
+    self.assertIsNotNone(self.main.LeaderboardSnapshot.get_by_key_name(
+        self.main.LeaderboardSnapshot.KEY_NAME))
+    # another instance loads the snapshot rather than scanning
+    other = self.main.LeaderboardIndex(3600, datetime.timedelta(seconds=60))
+    self.assertEqual(["team2", "team1", "team0"], [
+        row["team"] for row in other.page(10, "-totalCents")[1]])
+    self.assertEqual(1, other.stats["loads"])
+    self.assertEqual(0, other.stats["rebuilds"])
+
+  def testSnapshotTaskOff(self):
+    self.saveTotals()
+    self.assertEqual(200, self.snapshotTask().status_int)
+    self.assertEqual(0, self.index.stats["rebuilds"])
+    self.assertIsNone(self.main.LeaderboardSnapshot.get_by_key_name(
+        self.main.LeaderboardSnapshot.KEY_NAME))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,139 @@
+"""Tests for mailchimp updates queued by TaskQueueMailchimpQueue and run by
+MailchimpUpdateTask.
+"""
+
+import logging
+import unittest
+
+from tests import appengine
+
+
+class MailchimpQueueTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+    self.queue = self.main.pledge.TaskQueueMailchimpQueue()
+    self.patch(self.main, "MAILCHIMP_QUEUE", self.queue)
+    self.service = self.main.config_NOCOMMIT.pledge_service
+    self.updated = []
+    self.failures = []
+    self.patch(type(self.service), "updateMailchimp", self.updateMailchimp)
+    self.team = self.main.Team.create(title="Team", description="d",
+                                      primary_slug="team")
+    self.team_key = str(self.team.key())
+
+  def patch(self, owner, name, value):
+    self.addCleanup(setattr, owner, name, owner.__dict__[name])
+    setattr(owner, name, value)
+
+  def quiet(self):
+    # the failures these tests cause are logged as errors
+    logging.disable(logging.ERROR)
+    self.addCleanup(logging.disable, logging.NOTSET)
+
+  def updateMailchimp(self, team):
+    self.updated.append(team.primary_slug)
+    if self.failures:
+      return self.failures.pop(0)
+    return None
+
+  def taskTeams(self):
+    return [task.extract_params()["team"] for task in self.tasks("mailchimp")]
+
+  def testEditsCoalesce(self):
+    for _ in range(3):
+      self.main.enqueueMailchimpUpdate(self.team)
+    other = self.main.Team.create(title="Other", description="d",
+                                  primary_slug="other")
+    self.main.enqueueMailchimpUpdate(other)
+    self.assertEqual(sorted([self.team_key, str(other.key())]),
+                     sorted(self.taskTeams()))
+    self.assertEqual([200, 200], self.runTasks(self.main.app, "mailchimp"))
+    self.assertEqual(["other", "team"], sorted(self.updated))
+
+  def testEditWhileRunningQueuesAgain(self):
+    self.main.enqueueMailchimpUpdate(self.team)
+    task = self.tasks("mailchimp")[0]
+    self.assertEqual(200, self.runTask(self.main.app, task))
+    self.taskqueue.DeleteTask("mailchimp", task.name)
+    # the task cleared the pending flag, so the next edit has its own task
+    self.team.primary_slug = "renamed"
+    self.team.put()
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.assertEqual([self.team_key], self.taskTeams())
+    self.runTasks(self.main.app, "mailchimp")
+    self.assertEqual(["team", "renamed"], self.updated)
+
+  def testFailedEnqueueClearsPending(self):
+    self.quiet()
+    add = self.main.pledge.taskqueue.add
+
+    def failingAdd(*args, **kwargs):
+      raise self.main.taskqueue.TransientError("queue down")
+    self.patch(self.main.pledge.taskqueue, "add", failingAdd)
+    self.assertRaises(self.main.taskqueue.TransientError,
+                      self.queue.enqueue, self.team_key)
+    self.assertIsNone(self.main.memcache.get(
+        self.queue._pendingKey(self.team_key)))
+    # logged, the edit is saved anyway
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.assertEqual([], self.taskTeams())
+    self.main.pledge.taskqueue.add = add
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.assertEqual([self.team_key], self.taskTeams())
+
+  def testFailedUpdateIsRetried(self):
+    self.quiet()
+    self.failures.append(self.main.pledge.httpclient.FakeResponse(503))
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.assertEqual([500, 200], self.runTasks(self.main.app, "mailchimp"))
+    self.assertEqual(["team", "team"], self.updated)
+
+  def testEditDuringRetryQueuesAgain(self):
+    self.quiet()
+    self.failures.append(self.main.pledge.httpclient.FakeResponse(503))
+    self.main.enqueueMailchimpUpdate(self.team)
+    task = self.tasks("mailchimp")[0]
+    self.assertEqual(500, self.runTask(self.main.app, task))
+    # the failed task stays queued for its retry, and started() cleared the
+    # pending flag, so an edit meanwhile isn't lost
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.assertEqual([self.team_key, self.team_key], self.taskTeams())
+
+  def testDeletedTeam(self):
+    self.main.enqueueMailchimpUpdate(self.team)
+    self.team.delete()
+    self.assertEqual([200], self.runTasks(self.main.app, "mailchimp"))
+    self.assertEqual([], self.updated)
+
+
+class LocalMailchimpQueueTest(unittest.TestCase):
+
+  def setUp(self):
+    if appengine.sdkPath() is None:
+      raise unittest.SkipTest("needs the App Engine SDK, see APPENGINE_SDK")
+    import pledge
+    self.sleeps = []
+    self.queue = pledge.LocalMailchimpQueue(max_attempts=3,
+                                            sleep=self.sleeps.append)
+
+  def testFlushRetriesWithBackoff(self):
+    attempts = []
+
+    def update(team_key):
+      attempts.append(team_key)
+      if team_key == "bad" or len(attempts) == 1:
+        raise IOError("mailchimp down")
+    logging.disable(logging.ERROR)
+    self.addCleanup(logging.disable, logging.NOTSET)
+    for team_key in ["good", "bad", "good"]:
+      self.queue.enqueue(team_key)
+    self.assertEqual(["bad"], self.queue.flush(update))
+    self.assertEqual(["good", "good", "bad", "bad", "bad"], attempts)
+    self.assertEqual([1, 1, 2], self.sleeps)
+    self.assertEqual([], self.queue.flush(update))
+
+
+if __name__ == "__main__":
+  unittest.main()
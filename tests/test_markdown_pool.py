@@ -0,0 +1,48 @@
+"""Tests for the pooled markdown.markdown().
+
+  python -m unittest discover tests
+"""
+
+import unittest
+
+import markdown
+
+
+class MarkdownPoolTest(unittest.TestCase):
+
+  def testAbbreviationsDontLeakIntoLaterDocuments(self):
+    for extensions in (['abbr'], ['extra'], ['markdown.extensions.abbr']):
+      first = markdown.markdown("*[HTML]: Secret Title\n\nhello",
+                                extensions=extensions)
+      self.assertNotIn("Secret Title", first)
+      second = markdown.markdown("HTML is nice", extensions=extensions)
+      self.assertNotIn("Secret Title", second)
+      self.assertNotIn("<abbr", second)
+
+  def testAbbrIsNotPooled(self):
+    self.assertIsNone(markdown.get_pool(extensions=['abbr']))
+    self.assertIsNone(markdown.get_pool(extensions=['extra']))
+    self.assertIsNone(markdown.get_pool(extensions=['tables', 'abbr']))
+
+  def testPoolableConfigsShareAPool(self):
+    pool = markdown.get_pool(extensions=['tables'], output_format='html')
+    self.assertIsNotNone(pool)
+    self.assertIs(pool, markdown.get_pool(extensions=['tables'],
+                                          output_format='html'))
+    self.assertIsNotNone(markdown.get_pool())
+
+  def testPooledInstancesDontGrow(self):
+    pool = markdown.get_pool(extensions=['footnotes'])
+    md = pool.acquire()
+    pool.release(md)
+    patterns = len(md.inlinePatterns)
+    for i in range(3):
+      markdown.markdown("text[^%d]\n\n[^%d]: note %d" % (i, i, i),
+                        extensions=['footnotes'])
+    self.assertEqual(patterns, len(md.inlinePatterns))
+    self.assertNotIn("note 0", markdown.markdown("plain",
+                                                 extensions=['footnotes']))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,67 @@
+"""Tests for slug prefixes allocated by SlugPrefixes."""
+
+import threading
+import unittest
+
+from tests import appengine
+
+
+class SlugPrefixesTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+
+  def testFormatIsOddLength(self):
+    # legacy os.urandom prefixes have an even number of hex digits
+    for slug_id in [1, 15, 16, 255, 256, 4095, 4096, 2 ** 40]:
+      prefix = self.main.SlugPrefixes.format(slug_id)
+      self.assertEqual(1, len(prefix) % 2)
+      self.assertEqual(slug_id, int(prefix, 16))
+
+  def testInstancesDontCollide(self):
+    # each SlugPrefixes stands for an instance, allocating blocks at once
+    instances = [self.main.SlugPrefixes(7) for _ in range(4)]
+    prefixes = []
+    lock = threading.Lock()
+
+    def allocate(instance):
+      for _ in range(50):
+        prefix = instance.next()
+        with lock:
+          prefixes.append(prefix)
+    threads = [threading.Thread(target=allocate, args=(instance,))
+               for instance in instances for _ in range(2)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(400, len(prefixes))
+    self.assertEqual(400, len(set(prefixes)))
+
+  def testOneAllocationPerBlock(self):
+    calls = []
+    allocate_ids = self.main.db.allocate_ids
+
+    def countingAllocateIds(*args):
+      calls.append(args)
+      return allocate_ids(*args)
+    self.main.db.allocate_ids = countingAllocateIds
+    self.addCleanup(setattr, self.main.db, "allocate_ids", allocate_ids)
+    prefixes = self.main.SlugPrefixes(10)
+    for _ in range(25):
+      prefixes.next()
+    self.assertEqual(3, len(calls))
+
+  def testNewSlugKeepsUnchangedName(self):
+    team = self.main.Team.create(title="My Team", description="d")
+    slug = self.main.Slug.new(team)
+    self.assertTrue(slug.endswith("-My-Team"))
+    team.primary_slug = slug
+    self.assertEqual(slug, self.main.Slug.new(team))
+    team.title = "Other"
+    self.assertNotEqual(slug, self.main.Slug.new(team))
+
+
+if __name__ == "__main__":
+  unittest.main()
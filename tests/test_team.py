@@ -0,0 +1,64 @@
+"""Tests for the description_html backfill on Team."""
+
+import unittest
+
+from tests import appengine
+
+
+class DescriptionUpgradeTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+
+  def legacyTeam(self):
+    """A team put before description_html existed."""
+    from google.appengine.api import datastore
+    entity = datastore.Entity("Team")
+    entity["title"] = u"Legacy"
+    entity["description"] = self.main.db.Text(u"*hi*")
+    entity["primary_slug"] = u"legacy"
+    entity["team_version"] = 2
+    entity["modification_time"] = self.main.datetime.datetime(2014, 6, 1)
+    return datastore.Put(entity)
+
+  def testUpgradeKeepsModificationTime(self):
+    key = self.legacyTeam()
+    self.main.Team.upgrade(key)
+    team = self.main.Team.get(key)
+    self.assertIn("<em>hi</em>", team.description_html)
+    self.assertEqual(self.main.DESCRIPTION_RENDERER_VERSION,
+                     team.description_html_version)
+    self.assertEqual(self.main.Team.CURRENT_VERSION, team.team_version)
+    self.assertEqual(self.main.datetime.datetime(2014, 6, 1),
+                     team.modification_time)
+    self.assertFalse(team.needsUpgrade())
+
+  def testLazyUpgradeKeepsModificationTime(self):
+    key = self.legacyTeam()
+    html = self.main.Team.get(key).descriptionHtml()
+    self.assertIn("<em>hi</em>", html)
+    team = self.main.Team.get(key)
+    self.assertEqual(html, team.description_html)
+    self.assertEqual(self.main.datetime.datetime(2014, 6, 1),
+                     team.modification_time)
+
+  def testMigrationTask(self):
+    key = self.legacyTeam()
+    response = self.main.webapp2.Request.blank(
+        "/tasks/migrate/description_html", POST={}).get_response(
+            self.main.app)
+    self.assertEqual(200, response.status_int)
+    team = self.main.Team.get(key)
+    self.assertFalse(team.needsUpgrade())
+    self.assertEqual(self.main.datetime.datetime(2014, 6, 1),
+                     team.modification_time)
+
+  def testUpgradeOfMissingTeam(self):
+    key = self.legacyTeam()
+    self.main.db.delete(key)
+    self.main.Team.upgrade(key)
+
+
+if __name__ == "__main__":
+  unittest.main()
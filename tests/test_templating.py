@@ -0,0 +1,109 @@
+"""Tests for loading templates from compiled_templates/."""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from tests import appengine
+
+
+class FakeMemcache(object):
+  def get(self, key):
+    return None
+
+  def set(self, key, value, time=0):
+    pass
+
+
+def compileInto(compiled_dir):
+  """Compiles templates/ into compiled_dir the way precompile_templates.py
+  does, with whichever jinja2 is imported.
+  """
+  import jinja2
+  import templating
+  templating.COMPILED_DIR = compiled_dir
+  env = templating.makeEnvironment(
+      jinja2.FileSystemLoader(templating.TEMPLATE_DIR + "/"))
+  env.compile_templates(compiled_dir, zip=None, ignore_errors=False)
+  with open(os.path.join(compiled_dir, templating.MANIFEST), "w") as f:
+    json.dump(templating.manifest(), f)
+
+
+def renderAll(compiled_dir):
+  """Renders every template through templating.environment, and returns
+  the name of its loader.
+  """
+  import templating
+  templating.COMPILED_DIR = compiled_dir
+  env = templating.environment(FakeMemcache())
+  for name in templating.templateNames():
+    env.get_template(name)
+  env.get_template("leaderboard.html").render(teams=[])
+  return type(env.loader).__name__
+
+
+class CompiledTemplatesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.compiled_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.compiled_dir)
+    import templating
+    self.addCleanup(setattr, templating, "COMPILED_DIR",
+                    templating.COMPILED_DIR)
+
+  def testRendersCompiled(self):
+    compileInto(self.compiled_dir)
+    self.assertEqual("_FallbackLoader", renderAll(self.compiled_dir))
+
+  def testRendersCompiledWithRuntimeJinja2(self):
+    # the jinja2 2.6 app.yaml deploys, from the SDK
+    sdk = appengine.sdkPath()
+    lib = sdk and os.path.join(sdk, "lib")
+    if not lib or not os.path.isdir(os.path.join(lib, "jinja2-2.6")):
+      raise unittest.SkipTest("needs the SDK's jinja2-2.6")
+    script = (
+        "import sys\n"
+        "sys.path[:0] = [%r, %r, %r]\n"
+        "import jinja2\n"
+        "assert jinja2.__version__ == '2.6', jinja2.__version__\n"
+        "from tests import test_templating\n"
+        "test_templating.compileInto(%r)\n"
+        "print(test_templating.renderAll(%r))\n") % (
+            os.path.join(lib, "jinja2-2.6"),
+            os.path.join(lib, "markupsafe-0.15"), appengine.ROOT,
+            self.compiled_dir, self.compiled_dir)
+    process = subprocess.Popen([sys.executable, "-c", script],
+                               cwd=appengine.ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    self.assertEqual(0, process.returncode, output)
+    self.assertEqual("_FallbackLoader", output.strip().decode("utf-8"))
+
+  def testOtherJinja2VersionUsesSources(self):
+    compileInto(self.compiled_dir)
+    path = os.path.join(self.compiled_dir, "manifest.json")
+    with open(path) as f:
+      manifest = json.load(f)
+    manifest["jinja2"] = "0.1"
+    with open(path, "w") as f:
+      json.dump(manifest, f)
+    self.assertEqual("FileSystemLoader", renderAll(self.compiled_dir))
+
+  def testBrokenModuleFallsBackToSource(self):
+    compileInto(self.compiled_dir)
+    for name in os.listdir(self.compiled_dir):
+      if name.endswith(".py"):
+        with open(os.path.join(self.compiled_dir, name), "w") as f:
+          f.write("raise RuntimeError('compiled by another jinja2')\n")
+    logging.disable(logging.ERROR)
+    self.addCleanup(logging.disable, logging.NOTSET)
+    self.assertEqual("_FallbackLoader", renderAll(self.compiled_dir))
+
+
+if __name__ == "__main__":
+  unittest.main()
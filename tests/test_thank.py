@@ -0,0 +1,146 @@
+"""Tests for thank you jobs, sent in batches by ThankTask through
+TestPledgeService, which fakes THANK_TOTAL_PLEDGES pledges thanked
+THANK_BATCH_SIZE at a time.
+"""
+
+import logging
+import unittest
+
+from tests import appengine
+
+
+class ThankJobTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+    self.service = self.main.config_NOCOMMIT.pledge_service
+    self.sent = []
+    original = type(self.service).thankTeam
+
+    def thankTeam(service, team_key, data, offset=None, limit=None):
+      self.sent.append(offset)
+      return original(service, team_key, data, offset, limit)
+    self.patch(type(self.service), "thankTeam", thankTeam)
+    self.team = self.main.Team.create(title="Team", description="d",
+                                      primary_slug="team")
+    self.main.Slug(key_name="team", team=self.team).put()
+
+  def quiet(self):
+    # the failures these tests cause are logged as errors
+    logging.disable(logging.ERROR)
+    self.addCleanup(logging.disable, logging.NOTSET)
+
+  def patch(self, owner, name, value):
+    self.addCleanup(setattr, owner, name, owner.__dict__[name])
+    setattr(owner, name, value)
+
+  def startJob(self, subject=u"Thanks"):
+    job = self.main.ThankJob(team=self.team, reply_to="me@example.com",
+                             subject=subject, message_body=u"Thank you",
+                             new_members=True)
+    job.put()
+    self.main.enqueueThankBatch(job, 0)
+    return job.key()
+
+  def job(self, job_key):
+    return self.main.ThankJob.get(job_key)
+
+  def testSendsEveryBatchOnce(self):
+    job_key = self.startJob()
+    self.runTasks(self.main.app, "thank")
+    self.assertEqual([0, 3, 6], sorted(self.sent))
+    progress = self.job(job_key).progress()
+    self.assertEqual("done", progress["status"])
+    self.assertEqual(7, progress["num_emailed"])
+    self.assertEqual(7, progress["total_pledges"])
+    self.assertEqual(3, progress["batches_done"])
+    self.assertEqual(3, progress["batches_total"])
+
+  def testRetriedTaskDoesntResend(self):
+    self.quiet()
+    job_key = self.startJob()
+    batch_done = self.main.ThankJob.__dict__["batchDone"]
+    failures = [self.main.db.TransactionFailedError("contention")]
+
+    def flakyBatchDone(*args):
+      if failures:
+        raise failures.pop()
+      return batch_done.__func__(*args)
+    self.patch(self.main.ThankJob, "batchDone", staticmethod(flakyBatchDone))
+    statuses = self.runTasks(self.main.app, "thank")
+    self.assertEqual(500, statuses[0])
+    self.assertEqual([0, 3, 6], sorted(self.sent))
+    self.assertEqual("done", self.job(job_key).status)
+    self.assertEqual(7, self.job(job_key).num_emailed)
+
+  def testRunningTaskTwiceDoesntResend(self):
+    job_key = self.startJob()
+    task = self.tasks("thank")[0]
+    self.assertEqual(200, self.runTask(self.main.app, task))
+    self.assertEqual(200, self.runTask(self.main.app, task))
+    self.assertEqual([0], self.sent)
+    self.assertEqual(3, self.job(job_key).num_emailed)
+
+  def testUnrecordedClaimFailsJob(self):
+    self.quiet()
+    job_key = self.startJob()
+    # an earlier attempt claimed batch 0 and died before recording it
+    self.main.ThankBatch.claim(job_key.id(), 0)
+    self.runTasks(self.main.app, "thank")
+    self.assertEqual([], self.sent)
+    job = self.job(job_key)
+    self.assertEqual("failed", job.status)
+    self.assertIn("batch 0", job.error)
+
+  def testFailedBatchFailsJob(self):
+    self.quiet()
+    job_key = self.startJob()
+
+    def thankTeam(service, team_key, data, offset=None, limit=None):
+      raise IOError("pledge service down")
+    self.patch(type(self.service), "thankTeam", thankTeam)
+    self.assertEqual([200], self.runTasks(self.main.app, "thank"))
+    job = self.job(job_key)
+    self.assertEqual("failed", job.status)
+    self.assertEqual("pledge service down", job.error)
+
+  def login(self):
+    auth = self.main.config_NOCOMMIT.auth_service
+    auth._login("admin", "google")
+    self.addCleanup(auth._logout)
+    self.main.makeUserAdmin(auth._user["user_id"], self.team)
+
+  def post(self, **form):
+    data = {"reply_to": "me@example.com", "subject": "Thanks",
+            "message_body": "Thank you", "new_members": "y"}
+    data.update(form)
+    return self.main.webapp2.Request.blank(
+        "/t/team/thank", POST=data).get_response(self.main.app)
+
+  def testSubjectWithNewlines(self):
+    self.login()
+    subject = self.main.formsModule().DEFAULT_THANKYOU_SUBJECT
+    response = self.post(subject=subject)
+    self.assertEqual(302, response.status_int)
+    job = self.main.ThankJob.all().get()
+    self.assertEqual(subject, job.subject)
+    self.runTasks(self.main.app, "thank")
+    self.assertEqual("done", self.job(job.key()).status)
+
+  def testEnqueueFailureFailsJob(self):
+    self.quiet()
+    self.login()
+
+    def add(*args, **kwargs):
+      raise self.main.taskqueue.TransientError("queue down")
+    self.patch(self.main.taskqueue, "add", add)
+    response = self.post()
+    self.assertEqual(302, response.status_int)
+    job = self.main.ThankJob.all().get()
+    self.assertEqual("failed", job.status)
+    self.assertTrue(response.location.endswith("/thank/%d" % job.key().id()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,121 @@
+"""Tests for the UserTeams index of the teams each user is an admin of."""
+
+import unittest
+
+from tests import appengine
+
+
+class UserTeamsTest(appengine.TestCase):
+
+  def setUp(self):
+    appengine.TestCase.setUp(self)
+    self.main = appengine.importMain()
+    self.addCleanup(self.main._migrations_done.clear)
+    self.teams = [self.main.Team.create(title="Team %d" % i, description="d",
+                                        primary_slug="team-%d" % i)
+                  for i in range(3)]
+
+  def legacyAdmin(self, user_id, team):
+    """An AdminToTeam row saved before UserTeams existed."""
+    self.main.AdminToTeam(user=user_id, team=team).put()
+
+  def indexed(self, user_id):
+    index = self.main.UserTeams.get_by_key_name(user_id)
+    return index and [membership["title"]
+                      for membership in index.memberships()]
+
+  def migrate(self):
+    request = self.main.webapp2.Request.blank("/tasks/migrate/user_teams")
+    self.assertEqual(200, request.get_response(self.main.app).status_int)
+    self.runTasks(self.main.app)
+
+  def testReadsDontWrite(self):
+    self.legacyAdmin("alice", self.teams[0])
+    self.assertTrue(self.main.isUserAdmin("alice", self.teams[0]))
+    self.assertFalse(self.main.isUserAdmin("alice", self.teams[1]))
+    self.assertFalse(self.main.isUserAdmin("bob", self.teams[0]))
+    self.assertEqual(["Team 0"], [membership["title"] for membership in
+                                  self.main.UserTeams.forUser("alice")
+                                  .memberships()])
+    self.assertEqual(0, self.main.UserTeams.all().count())
+
+  def testAuthStateDoesntWrite(self):
+    self.legacyAdmin(self.userId("alice"), self.teams[0])
+    self.main.Slug(key_name="team-0", team=self.teams[0]).put()
+    self.login("alice")
+    response = self.main.webapp2.Request.blank(
+        "/auth/state.json?team=team-0").get_response(self.main.app)
+    self.assertIn("edit_url", response.json)
+    self.assertEqual(0, self.main.UserTeams.all().count())
+
+  def userId(self, name):
+    import hashlib
+    return hashlib.md5("google:%s" % name).hexdigest()
+
+  def login(self, name):
+    auth = self.main.config_NOCOMMIT.auth_service
+    auth._login(name, "google")
+    self.addCleanup(auth._logout)
+
+  def testMigration(self):
+    self.legacyAdmin("alice", self.teams[0])
+    self.legacyAdmin("alice", self.teams[1])
+    self.legacyAdmin("bob", self.teams[1])
+    self.migrate()
+    self.assertEqual(["Team 0", "Team 1"], self.indexed("alice"))
+    self.assertEqual(["Team 1"], self.indexed("bob"))
+    self.assertTrue(self.main.migrationDone(self.main.USER_TEAMS_MIGRATION))
+    # users without an index have no teams, and AdminToTeam isn't queried
+    self.legacyAdmin("carol", self.teams[2])
+    self.assertFalse(self.main.isUserAdmin("carol", self.teams[2]))
+
+  def testMigrationBatches(self):
+    task = self.main.MigrateUserTeamsTask
+    self.addCleanup(setattr, task, "BATCH_SIZE", task.BATCH_SIZE)
+    task.BATCH_SIZE = 2
+    for user_id in ["a", "b", "c", "d", "e"]:
+      self.legacyAdmin(user_id, self.teams[0])
+    self.migrate()
+    for user_id in ["a", "b", "c", "d", "e"]:
+      self.assertEqual(["Team 0"], self.indexed(user_id))
+
+  def testAddAdminBeforeMigration(self):
+    self.legacyAdmin("alice", self.teams[0])
+    self.main.makeUserAdmin("alice", self.teams[1])
+    # the legacy team is indexed along with the new one
+    self.assertEqual(["Team 0", "Team 1"], self.indexed("alice"))
+
+  def testAddAdminAfterMigration(self):
+    self.migrate()
+    self.main.makeUserAdmin("alice", self.teams[0])
+    self.main.makeUserAdmin("alice", self.teams[2])
+    self.main.makeUserAdmin("bob", self.teams[2])
+    self.assertEqual(["Team 0", "Team 2"], self.indexed("alice"))
+    self.assertEqual(["Team 2"], self.indexed("bob"))
+    self.assertTrue(self.main.isUserAdmin("alice", self.teams[2]))
+
+  def testRemoveAdmin(self):
+    self.migrate()
+    self.main.makeUserAdmin("alice", self.teams[0])
+    self.main.makeUserAdmin("alice", self.teams[1])
+    self.main.makeUserAdmin("bob", self.teams[1])
+    self.main.removeUserAdmin("alice", self.teams[1])
+    self.assertEqual(["Team 0"], self.indexed("alice"))
+    self.assertEqual(["Team 1"], self.indexed("bob"))
+    self.assertFalse(self.main.isUserAdmin("alice", self.teams[1]))
+    self.assertEqual(["bob"], [admin.user for admin in self.main.AdminToTeam
+                               .all().filter("team =", self.teams[1])])
+    # removing a team the user isn't an admin of does nothing
+    self.main.removeUserAdmin("bob", self.teams[0])
+    self.assertEqual(["Team 1"], self.indexed("bob"))
+
+  def testTeamChanged(self):
+    self.main.makeUserAdmin("alice", self.teams[0])
+    self.teams[0].title = "Renamed"
+    self.teams[0].put()
+    self.main.teamSaved(self.teams[0])
+    self.assertEqual(["Renamed"], self.indexed("alice"))
+
+
+if __name__ == "__main__":
+  unittest.main()
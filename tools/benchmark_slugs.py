@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Measures slug allocation throughput for a burst of new teams.
+
+  python tools/benchmark_slugs.py --sdk PATH [--teams N] [--threads N]
+
+Runs Slug.new for --teams new teams, all with the same title, from
+--threads threads against the SDK's local datastore stub. It compares
+that with the old allocation, which tried random prefixes in a
+transaction and grew them on collisions. It needs a config_NOCOMMIT.py
+in the repository root.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+# the app's directory, which main is imported from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacySlug(main, db, team):
+  """Slug.new as it was before prefixes came from SlugPrefixes."""
+  @db.transactional
+  def make(full_slug):
+    if main.Slug.get_by_key_name(full_slug) is not None:
+      return False
+    main.Slug(key_name=full_slug, team=team).put()
+    return True
+  slug_name = main.Slug.slugName(team.title)
+  token_amount = 2
+  tries = 0
+  while True:
+    tries += 1
+    full_slug = "%s-%s" % (os.urandom(token_amount).encode('hex'),
+                           slug_name)
+    token_amount += 1
+    if make(full_slug):
+      return full_slug, tries
+
+
+def run(name, allocate, teams, threads):
+  per_thread = [teams[i::threads] for i in xrange(threads)]
+  tries = [0]
+  lock = threading.Lock()
+
+  def worker(chunk):
+    for team in chunk:
+      _, attempts = allocate(team)
+      with lock:
+        tries[0] += attempts
+
+  workers = [threading.Thread(target=worker, args=(chunk,))
+             for chunk in per_thread]
+  start = time.time()
+  for w in workers:
+    w.start()
+  for w in workers:
+    w.join()
+  elapsed = time.time() - start
+  sys.stdout.write("%-8s %6d slugs %8.2fs %8.1f slugs/s %6.2f tries/slug\n" % (
+      name, len(teams), elapsed, len(teams) / elapsed,
+      float(tries[0]) / len(teams)))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--sdk", help="path to the App Engine SDK")
+  parser.add_argument("--teams", type=int, default=2000)
+  parser.add_argument("--threads", type=int, default=8)
+  args = parser.parse_args()
+  os.chdir(ROOT)
+  sys.path.insert(0, ROOT)
+  if args.sdk:
+    sys.path.insert(0, args.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+  from google.appengine.ext import db
+  from google.appengine.ext import testbed
+  bed = testbed.Testbed()
+  bed.activate()
+  import main as app_main
+
+  def newTeams():
+    # a fresh datastore per run, so runs don't slow each other down
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    teams = [app_main.Team(title="Burst Team", description="x")
+             for _ in xrange(args.teams)]
+    db.put(teams)
+    return teams
+
+  run("legacy", lambda team: legacySlug(app_main, db, team), newTeams(),
+      args.threads)
+  run("blocks", lambda team: (app_main.Slug.new(team), 1), newTeams(),
+      args.threads)
+  bed.deactivate()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Reports how long importing a module takes, per module it pulls in.
+
+  python tools/profile_imports.py [--sdk PATH] [module ...]
+
+Imports each module (main by default) with __import__ wrapped in a timer,
+then prints every module that got loaded with its own import time and its
+time including the modules it imported, slowest first. main needs the App
+Engine SDK and config_NOCOMMIT.py; --sdk adds the SDK to sys.path.
+"""
+
+import __builtin__
+import argparse
+import os
+import sys
+import time
+
+# the app's directory, which the modules are imported from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportTimer(object):
+  def __init__(self):
+    self.original = __builtin__.__import__
+    self.stack = []
+    self.times = {}  # module name -> [total seconds, self seconds]
+
+  def _import(self, name, globals=None, locals=None, fromlist=None,
+              level=-1):
+    already = set(sys.modules)
+    frame = [0.0]
+    self.stack.append(frame)
+    start = time.time()
+    try:
+      return self.original(name, globals, locals, fromlist, level)
+    finally:
+      total = time.time() - start
+      self.stack.pop()
+      if self.stack:
+        self.stack[-1][0] += total
+      loaded = [module for module in sys.modules
+                if module not in already and sys.modules[module] is not None]
+      if loaded:
+        # implicit relative imports ask for "util" and load "markdown.util".
+        # parent packages loaded on the way count toward the module.
+        named = [module for module in loaded
+                 if module == name or module.endswith("." + name)]
+        key = min(named or loaded, key=len)
+        self.times[key] = [total, total - frame[0]]
+
+  def __enter__(self):
+    __builtin__.__import__ = self._import
+    return self
+
+  def __exit__(self, *exc_info):
+    __builtin__.__import__ = self.original
+
+  def report(self, out, limit):
+    rows = sorted(self.times.iteritems(), key=lambda row: -row[1][1])
+    out.write("%10s %10s  %s\n" % ("self ms", "total ms", "module"))
+    for name, (total, own) in rows[:limit]:
+      out.write("%10.1f %10.1f  %s\n" % (own * 1000, total * 1000, name))
+    out.write("%d modules\n" % len(rows))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("modules", nargs="*", default=["main"])
+  parser.add_argument("--sdk", help="path to the App Engine SDK")
+  parser.add_argument("--limit", type=int, default=40)
+  args = parser.parse_args()
+  os.chdir(ROOT)
+  sys.path.insert(0, ROOT)
+  if args.sdk:
+    sys.path.insert(0, args.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+  with ImportTimer() as timer:
+    for module in args.modules:
+      __import__(module)
+  timer.report(sys.stdout, args.limit)
+
+
+if __name__ == "__main__":
+  main()